@@ -1,98 +1,251 @@
 from flask import Flask, render_template, request, redirect, flash, jsonify, url_for, send_from_directory
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
+from werkzeug.serving import WSGIRequestHandler, make_server
 import sqlite3
-from datetime import datetime, timedelta
+import db # Shared, pooled SQLite access layer
+import assets # Hashed, precompressed static files (built with `python assets.py`)
+import bus # Event bus between server workers
+import roster # Roster import/export commands
+import metrics
+from metrics import Counter, Gauge, Histogram
+from datetime import datetime, date, timedelta
+from collections import OrderedDict
 import os
+import uuid
+import signal
+import socket
 import time
+import threading
+import queue
 import subprocess # Import subprocess
 import sys # Import sys to get the Python executable path
 import atexit # Import atexit for cleanup
+import json
+import mimetypes
+import logging
+from logging.handlers import RotatingFileHandler
+
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 5000
+SUBSCRIPTION_TERM_DAYS = 30 # New users, and renewals that don't say otherwise
+
+if __name__ == "__main__" and sys.argv[1:2] in (["import"], ["export"]):
+    # Roster commands only need the database: run them before anything below starts the server's machinery
+    sys.exit(roster.main(sys.argv[1:], SUBSCRIPTION_TERM_DAYS, f"http://{SERVER_HOST}:{SERVER_PORT}/api/cache/reload"))
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'supersecretkey'
 # Initialize SocketIO with the app
 socketio = SocketIO(app)
 
-DB_FILE = "Kantinens_kunder.db"
+# Set by `python app.py serve N` for each of its worker processes (see Workers below)
+WORKERS = int(os.environ.get("KANTINE_WORKERS", 1))
+WORKER_ID = int(os.environ.get("KANTINE_WORKER_ID", 0))
+event_bus = bus.EventBus(enabled=WORKERS > 1)
+
+# --- Metrics (served at /metrics) ---
+SCAN_SECONDS = Histogram("kantine_scan_seconds", "Time to handle a /api/scan request", ["outcome"])
+AUTH_DB_LOOKUPS = Counter("kantine_auth_db_lookups_total", "Tag lookups that went to the database (cache misses)")
+AUTH_CACHE_HITS = Counter("kantine_auth_cache_hits_total", "Tag lookups served from the authorization cache",
+                          function=lambda: auth_cache.hits)
+AUTH_CACHE_SIZE_GAUGE = Gauge("kantine_auth_cache_entries", "UIDs in the authorization cache",
+                              function=lambda: auth_cache.stats()["size"])
+EMITS = Counter("kantine_socketio_emits_total", "scan_result events emitted", ["lane"])
+EMIT_RECIPIENTS = Counter("kantine_socketio_emit_recipients_total", "Displays reached by scan_result events (fan-out)", ["lane"])
+CLIENTS = Gauge("kantine_socketio_clients", "Connected Socket.IO clients", ["lane"])
+TAP_PHASE_SECONDS = Histogram("kantine_tap_phase_seconds", "Time from the previous phase of a traced tap to this one", ["phase"])
+SCANNER_RESTARTS = Counter("kantine_scanner_restarts_total", "Times the supervisor restarted scanner.py",
+                           function=lambda: scanner_status()["restarts"])
+client_lanes = {} # Socket.IO sid -> lane, so disconnects can be counted against the right lane
 
 # --- Scanner Process Management ---
 # IMPORTANT: Replace 'scanner.py' with the actual path to your scanner script
 # Ensure this path is correct relative to where you run app.py
 SCANNER_SCRIPT_PATH = "scanner.py"
-scanner_process = None # Variable to hold the scanner subprocess
+SCANNER_LOG_FILE = "scanner.log" # Everything the scanner prints ends up here
+SCANNER_HEARTBEAT_TIMEOUT = 30 # Seconds without a heartbeat before the scanner counts as hung
+SCANNER_RESTART_BACKOFF_MAX = 60 # Longest wait between restart attempts (seconds)
+SCANNER_STABLE_AFTER = 60 # A run this long resets the restart backoff
+HEARTBEAT_LINE = "@@heartbeat" # Must match scanner.HEARTBEAT_LINE
 
-def start_scanner_script():
-    """Starts the scanner.py script in a separate process."""
-    global scanner_process
-    # Check if the process is running or has finished
-    if scanner_process is None or scanner_process.poll() is not None:
-        print(f"Attempting to start scanner script: {SCANNER_SCRIPT_PATH}")
+# The scanner's output is drained line by line into this logger, so the pipes
+# never fill up (a full pipe blocks the scanner on print and it stops scanning).
+scanner_log = logging.getLogger("scanner")
+scanner_log.setLevel(logging.INFO)
+scanner_log.propagate = False
+_scanner_log_handler = RotatingFileHandler(SCANNER_LOG_FILE, maxBytes=1_000_000, backupCount=3,
+                                            encoding="utf-8", delay=True)
+_scanner_log_handler.setFormatter(logging.Formatter(
+    "%(asctime)s level=%(levelname)s pid=%(scanner_pid)s stream=%(stream)s msg=%(message)s"))
+scanner_log.addHandler(_scanner_log_handler)
+
+class ScannerSupervisor:
+    """
+    Runs scanner.py as a child process and keeps it running: drains its output
+    into scanner_log, watches its heartbeat (scanner.HEARTBEAT_LINE on stdout)
+    and restarts it with exponential backoff when it exits or hangs.
+    """
+
+    def __init__(self, script_path=SCANNER_SCRIPT_PATH):
+        self.script_path = script_path
+        self.process = None
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.monitor_thread = None
+        self.started_at = None # time.time() of the current run
+        self.last_heartbeat = None # time.monotonic() of the last heartbeat line
+        self.last_tap_at = None # time.time() of the last /api/scan
+        self.last_exit_code = None
+        self.restarts = 0
+        self.backoff = 1
+
+    def start(self):
+        """Starts the scanner and the monitor thread that keeps it alive."""
+        self.stopping.clear()
+        with self.lock:
+            self._spawn()
+        if self.monitor_thread is None or not self.monitor_thread.is_alive():
+            self.monitor_thread = threading.Thread(target=self._monitor, name="scanner-supervisor", daemon=True)
+            self.monitor_thread.start()
+
+    def _spawn(self):
+        if self.process is not None and self.process.poll() is None:
+            print("Scanner script is already running.")
+            return
+        print(f"Attempting to start scanner script: {self.script_path}")
         try:
             # Use sys.executable to ensure the script is run with the same Python interpreter
-            # used for the Flask app.
-            # stdout and stderr are redirected to PIPE so they don't clutter the main console
-            # You could log these outputs if needed.
-            # We use bufsize=1 for line buffering, which might help with real-time output processing
-            scanner_process = subprocess.Popen([sys.executable, SCANNER_SCRIPT_PATH],
-                                               stdout=subprocess.PIPE,
-                                               stderr=subprocess.PIPE,
-                                               text=True, # Decode output as text
-                                               bufsize=1)
-            print(f"Scanner script started successfully with PID: {scanner_process.pid}")
-
-            # Optional: Start a thread to read scanner output if you want to display it
-            # from threading import Thread
-            # def read_scanner_output(process):
-            #     for line in iter(process.stdout.readline, ''):
-            #         print(f"SCANNER_OUT: {line.strip()}")
-            #     for line in iter(process.stderr.readline, ''):
-            #         print(f"SCANNER_ERR: {line.strip()}")
-            # Thread(target=read_scanner_output, args=(scanner_process,), daemon=True).start()
-
-        except FileNotFoundError:
-            print(f"Error: Scanner script not found at '{SCANNER_SCRIPT_PATH}'. Make sure the path is correct.")
-            scanner_process = None
-        except Exception as e:
+            # used for the Flask app. -u: unbuffered, so heartbeats arrive when they are printed.
+            self.process = subprocess.Popen([sys.executable, "-u", self.script_path],
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE,
+                                            text=True, # Decode output as text
+                                            bufsize=1)
+        except OSError as e:
             print(f"Error starting scanner script: {e}")
-            scanner_process = None
-    else:
-        print("Scanner script is already running.")
+            self.process = None
+            return
+        self.started_at = time.time()
+        self.last_heartbeat = time.monotonic()
+        print(f"Scanner script started successfully with PID: {self.process.pid}")
+        for stream_name, stream in (("stdout", self.process.stdout), ("stderr", self.process.stderr)):
+            threading.Thread(target=self._drain, args=(self.process, stream_name, stream),
+                             name=f"scanner-{stream_name}", daemon=True).start()
+
+    def _drain(self, process, stream_name, stream):
+        """Reads one of the scanner's pipes until it closes."""
+        extra = {"scanner_pid": process.pid, "stream": stream_name}
+        for line in iter(stream.readline, ''):
+            line = line.rstrip()
+            if line == HEARTBEAT_LINE:
+                self.last_heartbeat = time.monotonic()
+            elif line:
+                scanner_log.log(logging.WARNING if stream_name == "stderr" else logging.INFO, line, extra=extra)
+        stream.close()
+
+    def _monitor(self):
+        while not self.stopping.wait(1):
+            with self.lock:
+                process = self.process
+                if process is None:
+                    exit_code = "not started"
+                elif process.poll() is not None:
+                    exit_code = process.returncode
+                elif time.monotonic() - self.last_heartbeat > SCANNER_HEARTBEAT_TIMEOUT:
+                    print(f"Scanner (PID {process.pid}) sent no heartbeat for {SCANNER_HEARTBEAT_TIMEOUT}s, killing it.")
+                    process.kill()
+                    process.wait()
+                    exit_code = "hung"
+                else:
+                    if time.time() - self.started_at > SCANNER_STABLE_AFTER:
+                        self.backoff = 1
+                    continue
+                self.last_exit_code = exit_code
+                delay = self.backoff
+                self.backoff = min(self.backoff * 2, SCANNER_RESTART_BACKOFF_MAX)
+            print(f"Scanner script stopped ({exit_code}), restarting in {delay}s.")
+            if self.stopping.wait(delay):
+                return
+            with self.lock:
+                self.restarts += 1
+                self._spawn()
+
+    def stop(self):
+        """Stops the scanner process and its supervision."""
+        self.stopping.set()
+        with self.lock:
+            process = self.process
+            if process is None or process.poll() is not None:
+                print("Scanner script is not running.")
+                return
+            print(f"Attempting to stop scanner script with PID: {process.pid}")
+            try:
+                process.terminate() # Send SIGTERM
+                process.wait(timeout=5)
+                print("Scanner script stopped gracefully.")
+            except subprocess.TimeoutExpired:
+                print("Scanner script did not terminate gracefully within timeout, killing.")
+                process.kill() # Send SIGKILL
+                process.wait()
+            finally:
+                self.process = None
+
+    def record_tap(self):
+        self.last_tap_at = time.time()
+
+    def status(self):
+        with self.lock:
+            process = self.process
+            running = process is not None and process.poll() is None
+            now = time.time()
+            return {
+                "running": running,
+                "pid": process.pid if running else None,
+                "started_at": datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds") if running else None,
+                "uptime_s": round(now - self.started_at, 1) if running else None,
+                "restarts": self.restarts,
+                "last_exit_code": self.last_exit_code,
+                "last_heartbeat_s_ago": round(time.monotonic() - self.last_heartbeat, 1) if running else None,
+                "last_tap_at": datetime.fromtimestamp(self.last_tap_at).isoformat(timespec="seconds") if self.last_tap_at else None,
+            }
+
+scanner_supervisor = ScannerSupervisor()
+
+def start_scanner_script():
+    """Starts the scanner.py script in a separate, supervised process."""
+    scanner_supervisor.start()
 
 def stop_scanner_script():
     """Stops the scanner.py script process."""
-    global scanner_process
-    if scanner_process is not None and scanner_process.poll() is None:
-        print(f"Attempting to stop scanner script with PID: {scanner_process.pid}")
-        try:
-            scanner_process.terminate() # Send SIGTERM
-            # Wait for process to terminate, with a timeout
-            stdout, stderr = scanner_process.communicate(timeout=5)
-            print("Scanner script stopped gracefully.")
-            # print("Scanner stdout:\n", stdout) # Optional: print collected output
-            # print("Scanner stderr:\n", stderr) # Optional: print collected errors
-        except subprocess.TimeoutExpired:
-            print("Scanner script did not terminate gracefully within timeout, killing.")
-            scanner_process.kill() # Send SIGKILL
-            stdout, stderr = scanner_process.communicate() # Collect output after kill
-            # print("Scanner stdout:\n", stdout) # Optional: print collected output
-            # print("Scanner stderr:\n", stderr) # Optional: print collected errors
-        except Exception as e:
-            print(f"Error stopping scanner script: {e}")
-        finally:
-            scanner_process = None
-    else:
-        print("Scanner script is not running.")
+    scanner_supervisor.stop()
+
+# With `python app.py serve N` the parent process supervises the scanner and
+# publishes its status on the event bus every WORKER_CHECK_INTERVAL; the
+# workers keep the last one here (see Workers below)
+parent_scanner_status = {}
+
+def scanner_status():
+    """The scanner's status, from our own supervisor or, in a worker, as last published by the parent."""
+    status = scanner_supervisor.status()
+    if WORKERS > 1:
+        # The parent doesn't see taps; last_tap_at is this worker's own
+        status.update((key, value) for key, value in parent_scanner_status.items() if key != "last_tap_at")
+    return status
 
 # Register stop_scanner_script to be called when the Flask app exits
 # This ensures the scanner process is cleaned up when you stop the Flask server
 atexit.register(stop_scanner_script)
+atexit.register(db.close_all) # Close pooled DB connections on exit
 
 
 # --- Database Functions ---
 
 # Ensure DB exists and is initialized
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
+    with db.transaction() as conn:
+        init_schema(conn)
+
+def init_schema(conn):
     cursor = conn.cursor()
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -102,6 +255,42 @@ def init_db():
             subscription_valid_until TEXT
         )
     ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scans (
+            id INTEGER PRIMARY KEY,
+            uid TEXT,
+            lane TEXT,
+            outcome TEXT,
+            scanned_at TEXT,
+            latency_ms REAL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scans_scanned_at ON scans (scanned_at)")
+    # Scan counts per day / ISO week, lane and outcome, added to as scans are logged (see Stats)
+    new_rollups = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'scan_daily'").fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scan_daily (
+            day TEXT NOT NULL,
+            lane TEXT NOT NULL,
+            outcome TEXT NOT NULL,
+            scans INTEGER NOT NULL,
+            PRIMARY KEY (day, lane, outcome)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scan_weekly (
+            week TEXT NOT NULL,
+            lane TEXT NOT NULL,
+            outcome TEXT NOT NULL,
+            scans INTEGER NOT NULL,
+            PRIMARY KEY (week, lane, outcome)
+        )
+    ''')
+    if new_rollups:
+        # First start with rollups: count what is already in the scan log, once
+        # (a scan without a lane counts for lane 1, the DEFAULT_LANE)
+        rows = cursor.execute("SELECT substr(scanned_at, 1, 10), IFNULL(lane, '1'), outcome, COUNT(*) FROM scans GROUP BY 1, 2, 3").fetchall()
+        add_to_rollups(cursor, {(day, lane, outcome): n for day, lane, outcome, n in rows})
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS foods (
             id INTEGER PRIMARY KEY,
@@ -109,84 +298,730 @@ def init_db():
             image_url TEXT
         )
     ''')
+    # Older databases have foods without allergens
+    food_columns = [row[1] for row in cursor.execute("PRAGMA table_info(foods)")]
+    if "allergens" not in food_columns:
+        cursor.execute("ALTER TABLE foods ADD COLUMN allergens TEXT") # Comma-separated, e.g. 'Gluten,Mælk'
     # Add some sample food data if the table is empty
     cursor.execute("SELECT COUNT(*) FROM foods")
     if cursor.fetchone()[0] == 0:
         cursor.execute("INSERT INTO foods (name, image_url) VALUES (?, ?)", ('Frokost Ret', '')) # Add a placeholder food item
-        conn.commit()
+    init_user_changes(cursor)
+    # The menu of a day: a description plus an ordered list of dishes from foods
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS menus (
+            menu_date TEXT PRIMARY KEY,
+            description TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS menu_items (
+            menu_date TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            food_id INTEGER NOT NULL REFERENCES foods (id),
+            PRIMARY KEY (menu_date, position)
+        )
+    ''')
+    # Meals served per card and day (see MealQuota)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meal_usage (
+            nfc_id TEXT NOT NULL,
+            usage_date TEXT NOT NULL,
+            meals INTEGER NOT NULL,
+            PRIMARY KEY (nfc_id, usage_date)
+        )
+    ''')
+    init_user_search(cursor)
+    run_migrations(cursor)
+
+# Change counter for users: every insert/update stamps the row with the next
+# value of counters['users'] (users.change_seq), and deletes leave a tombstone
+# with their own number. /api/users/changes?since=N then returns exactly what
+# changed after N, which is how scanner.py keeps its offline snapshot in sync.
+USER_CHANGE_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS users_change_insert AFTER INSERT ON users BEGIN
+           UPDATE counters SET value = value + 1 WHERE name = 'users';
+           UPDATE users SET change_seq = (SELECT value FROM counters WHERE name = 'users') WHERE id = new.id;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS users_change_update AFTER UPDATE OF nfc_id, name, subscription_valid_until ON users BEGIN
+           UPDATE counters SET value = value + 1 WHERE name = 'users';
+           UPDATE users SET change_seq = (SELECT value FROM counters WHERE name = 'users') WHERE id = new.id;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS users_change_delete AFTER DELETE ON users BEGIN
+           UPDATE counters SET value = value + 1 WHERE name = 'users';
+           INSERT INTO user_tombstones (nfc_id, change_seq) VALUES (old.nfc_id, (SELECT value FROM counters WHERE name = 'users'));
+       END''',
+]
 
-    conn.commit()
-    conn.close()
+def init_user_changes(cursor):
+    cursor.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS user_tombstones (nfc_id TEXT, change_seq INTEGER PRIMARY KEY)")
+    user_columns = [row[1] for row in cursor.execute("PRAGMA table_info(users)")]
+    if "change_seq" not in user_columns:
+        # Existing users get numbered by id, and the counter continues after them
+        cursor.execute("ALTER TABLE users ADD COLUMN change_seq INTEGER")
+        cursor.execute("UPDATE users SET change_seq = id")
+    cursor.execute("INSERT OR IGNORE INTO counters (name, value) SELECT 'users', COALESCE(MAX(change_seq), 0) FROM users")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_change_seq ON users (change_seq)")
+    for statement in USER_CHANGE_TRIGGERS:
+        cursor.execute(statement)
+
+USER_CHANGES_PAGE_MAX = 5000
+
+def get_user_changes(since, limit):
+    """Users changed after version `since`, oldest first: (change_seq, nfc_id, valid_until or None, deleted)."""
+    rows = db.query_all("""
+        SELECT change_seq, nfc_id, subscription_valid_until, 0 FROM users WHERE change_seq > ?
+        UNION ALL
+        SELECT change_seq, nfc_id, NULL, 1 FROM user_tombstones WHERE change_seq > ?
+        ORDER BY 1 LIMIT ?
+    """, (since, since, limit))
+    return rows
+
+# Full-text index over users.name for the admin search. It's an external-content
+# FTS5 table (no copy of the data), kept in sync by triggers. If this SQLite
+# build has no FTS5, search falls back to a LIKE prefix match.
+users_fts_enabled = False
+
+USERS_FTS_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+           INSERT INTO users_fts (rowid, name) VALUES (new.id, new.name);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+           INSERT INTO users_fts (users_fts, rowid, name) VALUES ('delete', old.id, old.name);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF name ON users BEGIN
+           INSERT INTO users_fts (users_fts, rowid, name) VALUES ('delete', old.id, old.name);
+           INSERT INTO users_fts (rowid, name) VALUES (new.id, new.name);
+       END''',
+]
+
+def init_user_search(cursor):
+    global users_fts_enabled
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'").fetchone()
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS users_fts
+            USING fts5(name, content='users', content_rowid='id')
+        ''')
+    except sqlite3.OperationalError as e:
+        print(f"FTS5 not available ({e}), user search will use LIKE.")
+        users_fts_enabled = False
+        return
+    for statement in USERS_FTS_TRIGGERS:
+        cursor.execute(statement)
+    if not exists:
+        # First start with the index: fill it from the existing users
+        cursor.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+    users_fts_enabled = True
+
+# --- Schema Migrations ---
+# Numbered schema changes, each applied once and in order; PRAGMA user_version
+# holds how many have run. (The CREATE ... IF NOT EXISTS and column checks in
+# init_schema predate this and stay as they are.)
+
+# Expiry as a day number (date.toordinal()), NULL unless subscription_valid_until is a real YYYY-MM-DD date.
+# julianday() - 1721424.5 is the proleptic Gregorian ordinal Python uses.
+VALID_UNTIL_DAY_SQL = """
+    CASE WHEN date(julianday(subscription_valid_until)) = subscription_valid_until
+         THEN CAST(julianday(subscription_valid_until) - 1721424.5 AS INTEGER) END
+"""
+
+def migrate_valid_until_day(cursor):
+    """1: sortable, indexed expiry column, computed by SQLite so no write path can forget it."""
+    cursor.execute(f"ALTER TABLE users ADD COLUMN valid_until_day INTEGER GENERATED ALWAYS AS ({VALID_UNTIL_DAY_SQL}) VIRTUAL")
+    cursor.execute("CREATE INDEX idx_users_valid_until_day ON users (valid_until_day)")
+
+def migrate_scan_tap_id(cursor):
+    """2: tap_id on logged scans, so a tap that reaches the server twice (live and replayed) is handled once."""
+    cursor.execute("ALTER TABLE scans ADD COLUMN tap_id TEXT")
+    cursor.execute("CREATE INDEX idx_scans_tap_id ON scans (tap_id) WHERE tap_id IS NOT NULL")
+
+def migrate_pad_valid_until(cursor):
+    """3: zero-padded expiry dates (2026-11-1 -> 2026-11-01), which valid_until_day can read."""
+    rows = cursor.execute("""
+        SELECT id, subscription_valid_until FROM users
+        WHERE valid_until_day IS NULL AND subscription_valid_until IS NOT NULL
+    """).fetchall()
+    for user_id, valid_until_str in rows:
+        valid_until = parse_valid_until(valid_until_str)
+        if valid_until is not None:
+            cursor.execute("UPDATE users SET subscription_valid_until = ? WHERE id = ?", (valid_until.isoformat(), user_id))
+
+MIGRATIONS = [migrate_valid_until_day, migrate_scan_tap_id, migrate_pad_valid_until]
+
+def run_migrations(cursor):
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        print(f"Migrating database to schema version {number}: {migration.__doc__.split(':', 1)[1].strip()}")
+        migration(cursor)
+        cursor.execute(f"PRAGMA user_version = {number}") # Part of the same transaction as the migration
 
 # Fetch tag owner
 def get_tag_by_uid(uid):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT name, subscription_valid_until FROM users WHERE nfc_id = ?", (uid,))
-    result = cursor.fetchone()
-    conn.close()
-    return result
+    AUTH_DB_LOOKUPS.inc()
+    return db.query_one("SELECT name, subscription_valid_until, valid_until_day FROM users WHERE nfc_id = ?", (uid,))
+
+# --- Daily Menu ---
+# Menus are stored per date (menus + menu_items -> foods). The payload for
+# today is built once and then served from memory on every authorized tap;
+# it is rebuilt when the date changes or when the menu is edited.
+
+def split_allergens(text):
+    return [a.strip() for a in (text or "").split(",") if a.strip()]
+
+def parse_allergens(value):
+    """A dish's allergens from a request: a list of names or a comma-separated string. None if it is neither."""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return split_allergens(value)
+    if isinstance(value, list) and all(isinstance(a, str) and "," not in a for a in value):
+        return [a.strip() for a in value if a.strip()]
+    return None
+
+def get_menu(menu_date):
+    """Loads the menu of a date (YYYY-MM-DD) as a food_info dict, or None if there is no menu that day."""
+    menu = db.query_one("SELECT description FROM menus WHERE menu_date = ?", (menu_date,))
+    if menu is None:
+        return None
+    dishes = db.query_all("""
+        SELECT f.name, f.image_url, f.allergens FROM menu_items m JOIN foods f ON f.id = m.food_id
+        WHERE m.menu_date = ? ORDER BY m.position
+    """, (menu_date,))
+    retter = [{"navn": name, "billede": image_url or "", "allergener": split_allergens(allergens)}
+              for name, image_url, allergens in dishes]
+    allergener = []
+    for ret in retter:
+        allergener.extend(a for a in ret["allergener"] if a not in allergener)
+    return {
+        "dato": menu_date,
+        "beskrivelse": menu[0] or ", ".join(ret["navn"] for ret in retter),
+        "allergener": allergener, # All allergens of the day, as shown on the terminal
+        "retter": retter,
+    }
+
+def save_menu(menu_date, description, dishes):
+    """
+    Replaces the menu of a date. `dishes` is a list of dicts with name,
+    image_url and allergens (list); dishes are matched to foods by name.
+    """
+    with db.transaction() as conn:
+        conn.execute("""
+            INSERT INTO menus (menu_date, description) VALUES (?, ?)
+            ON CONFLICT(menu_date) DO UPDATE SET description = excluded.description
+        """, (menu_date, description))
+        conn.execute("DELETE FROM menu_items WHERE menu_date = ?", (menu_date,))
+        for position, dish in enumerate(dishes):
+            allergens = ",".join(dish.get("allergens") or [])
+            row = conn.execute("SELECT id FROM foods WHERE name = ?", (dish["name"],)).fetchone()
+            if row:
+                food_id = row[0]
+                conn.execute("UPDATE foods SET image_url = ?, allergens = ? WHERE id = ?",
+                             (dish.get("image_url", ""), allergens, food_id))
+            else:
+                food_id = conn.execute("INSERT INTO foods (name, image_url, allergens) VALUES (?, ?, ?)",
+                                       (dish["name"], dish.get("image_url", ""), allergens)).lastrowid
+            conn.execute("INSERT INTO menu_items (menu_date, position, food_id) VALUES (?, ?, ?)",
+                         (menu_date, position, food_id))
+    today_menu.invalidate()
+    event_bus.publish("menu_changed", {"menu_date": menu_date})
+
+def delete_menu(menu_date):
+    with db.transaction() as conn:
+        conn.execute("DELETE FROM menu_items WHERE menu_date = ?", (menu_date,))
+        conn.execute("DELETE FROM menus WHERE menu_date = ?", (menu_date,))
+    today_menu.invalidate()
+    event_bus.publish("menu_changed", {"menu_date": menu_date})
+
+class TodayMenu:
+    """Today's food_info, memoized until midnight or until invalidate() (menu edited)."""
 
-# Fetch food list (or just the current day's food)
-# For simplicity, let's just return a static food item for now
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.day = None
+        self.payload = None
+
+    def get(self):
+        today = date.today()
+        if self.day == today: # Fast path: no lock, no query
+            return self.payload
+        with self.lock:
+            if self.day != today:
+                self.payload = get_menu(today.isoformat())
+                self.day = today
+            return self.payload
+
+    def invalidate(self):
+        with self.lock:
+            self.day = None
+
+today_menu = TodayMenu()
+
+# Fetch the current day's food (served from memory, see TodayMenu)
 def get_current_food_info():
-     # In a real app, this would fetch based on the date or a selection
-     # For now, return a placeholder
-     return {
-         "beskrivelse": "Dagens ret er en lækker pastasalat med kylling og pesto.",
-         "allergener": ["Gluten", "Mælk", "Nødder"] # Example allergens
-     }
+    return today_menu.get()
 
 
 # Add new user
 def add_user(nfc_id, name, subscription_valid_until):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
     try:
-        cursor.execute("""
-            INSERT INTO users (nfc_id, name, subscription_valid_until)
-            VALUES (?, ?, ?)
-        """, (nfc_id, name, subscription_valid_until))
-        conn.commit()
-        return True
+        with db.transaction() as conn:
+            conn.execute("""
+                INSERT INTO users (nfc_id, name, subscription_valid_until)
+                VALUES (?, ?, ?)
+            """, (nfc_id, name, subscription_valid_until))
     except sqlite3.IntegrityError:
         # UID already exists
         return False
-    finally:
-        conn.close()
+    # Write-through so the next tap with this UID is served from memory
+    auth_cache.put(nfc_id, make_auth_entry(name, subscription_valid_until))
+    tap_dedup.forget(nfc_id) # A 'new card' decision from a moment ago no longer applies
+    event_bus.publish("user_changed", {"uids": [nfc_id]})
+    return True
 
 # Update user name
 def update_user_name(tag_id, new_name):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET name = ? WHERE id = ?", (new_name, tag_id))
-    conn.commit()
-    conn.close()
+    with db.transaction() as conn:
+        conn.execute("UPDATE users SET name = ? WHERE id = ?", (new_name, tag_id))
+        row = conn.execute("SELECT nfc_id, name, subscription_valid_until, valid_until_day FROM users WHERE id = ?",
+                           (tag_id,)).fetchone()
+    if row:
+        auth_cache.put(row[0], make_auth_entry(*row[1:]))
+        event_bus.publish("user_changed", {"uids": [row[0]]})
+
+def renew_subscriptions(uids=None, expiring_within=None, days=SUBSCRIPTION_TERM_DAYS, until=None):
+    """
+    Renews many subscriptions with one UPDATE: the users in `uids`, or those whose subscription
+    ends within `expiring_within` days (already expired ones included), or everyone if neither is given.
+    Each gets `days` more from its current expiry (from today if that has passed), or `until` (a date).
+    Returns the number of users renewed.
+    """
+    today = date.today().toordinal()
+    if until is not None:
+        new_expiry, params = "?", [until.isoformat()] # Zero-padded, or VALID_UNTIL_DAY_SQL can't read it
+    else:
+        # Back from a day number to YYYY-MM-DD (see VALID_UNTIL_DAY_SQL)
+        new_expiry, params = "date(max(COALESCE(valid_until_day, 0), ?) + ? + 1721424.5)", [today, days]
+    if uids is not None:
+        where = f"nfc_id IN ({','.join('?' * len(uids))})"
+        params += list(uids)
+    elif expiring_within is not None:
+        where = "valid_until_day <= ?" # Index range scan
+        params.append(today + expiring_within)
+    else:
+        where = "1"
+    with db.transaction() as conn:
+        rows = conn.execute(f"""
+            UPDATE users SET subscription_valid_until = {new_expiry} WHERE {where}
+            RETURNING nfc_id, name, subscription_valid_until, valid_until_day
+        """, params).fetchall()
+    for nfc_id, name, valid_until_str, valid_until_day in rows:
+        auth_cache.put(nfc_id, make_auth_entry(name, valid_until_str, valid_until_day))
+        tap_dedup.forget(nfc_id)
+    if rows:
+        event_bus.publish("user_changed", {"uids": [row[0] for row in rows]})
+    return len(rows)
+
+def get_expiring_users(days, limit=None):
+    """Active subscriptions that end within the next `days` days, soonest first (reads only the index range)."""
+    today = date.today().toordinal()
+    return db.query_all("""
+        SELECT id, nfc_id, name, subscription_valid_until FROM users
+        WHERE valid_until_day > ? AND valid_until_day <= ?
+        ORDER BY valid_until_day, id
+        LIMIT ?
+    """, (today, today + days, -1 if limit is None else limit))
+
+USERS_PAGE_SIZE = 50 # Default page size for /api/users
+USERS_PAGE_MAX = 200
+
+def fts_prefix_query(search):
+    """Turns free text into an FTS5 query where every word is a quoted prefix: 'an pe' -> '"an"* "pe"*'."""
+    words = search.replace('"', ' ').split()
+    return " ".join(f'"{word}"*' for word in words)
+
+# List users one page at a time (keyset pagination on id, so page N costs the same as page 1)
+def list_users(after_id=0, limit=USERS_PAGE_SIZE, search=None):
+    columns = "u.id, u.nfc_id, u.name, u.subscription_valid_until"
+    query = fts_prefix_query(search) if search else ""
+    if query and users_fts_enabled:
+        rows = db.query_all(f"""
+            SELECT {columns} FROM users_fts f JOIN users u ON u.id = f.rowid
+            WHERE users_fts MATCH ? AND u.id > ?
+            ORDER BY u.id LIMIT ?
+        """, (query, after_id, limit))
+    elif query:
+        rows = db.query_all(f"""
+            SELECT {columns} FROM users u
+            WHERE u.name LIKE ? AND u.id > ?
+            ORDER BY u.id LIMIT ?
+        """, (search.strip() + "%", after_id, limit))
+    else:
+        rows = db.query_all(f"SELECT {columns} FROM users u WHERE u.id > ? ORDER BY u.id LIMIT ?",
+                            (after_id, limit))
+    return rows
+
+
+# --- Authorization Cache ---
+# Every tap used to open the DB and strptime the expiry string. Instead we keep
+# UID -> (name, valid_until_str, valid_until date) in memory, warmed at startup
+# and kept coherent by add_user/update_user_name (write-through).
+
+AUTH_CACHE_SIZE = 10000 # Max number of UIDs kept in memory (LRU eviction beyond this)
+_NOT_CACHED = object() # Sentinel: UID not in the cache, caller has to ask the DB
+
+def parse_valid_until(valid_until_str):
+    """Parses a 'YYYY-MM-DD' expiry string. Returns a date, or None if missing/invalid."""
+    if not valid_until_str:
+        return None
+    try:
+        return datetime.strptime(valid_until_str, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
+
+def make_auth_entry(name, valid_until_str, valid_until_day=None):
+    """Builds a cache entry with the expiry date parsed once, up front (or taken from valid_until_day)."""
+    if valid_until_day is not None:
+        return (name, valid_until_str, date.fromordinal(valid_until_day))
+    return (name, valid_until_str, parse_valid_until(valid_until_str))
+
+class AuthCache:
+    """Thread-safe LRU map of NFC UID -> auth entry, with hit/miss counters.
+
+    A value of None is a negative entry: the UID is known not to be registered.
+    """
+
+    def __init__(self, maxsize=AUTH_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, uid):
+        """Returns the cached entry (or None for a known-unknown UID), else _NOT_CACHED."""
+        with self._lock:
+            try:
+                entry = self._entries[uid]
+            except KeyError:
+                self.misses += 1
+                return _NOT_CACHED
+            self._entries.move_to_end(uid)
+            self.hits += 1
+            return entry
+
+    def put(self, uid, entry):
+        with self._lock:
+            self._entries[uid] = entry
+            self._entries.move_to_end(uid)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False) # Evict least recently used
+
+    def invalidate(self, uid):
+        with self._lock:
+            self._entries.pop(uid, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": self.maxsize,
+                    "hits": self.hits, "misses": self.misses}
+
+auth_cache = AuthCache()
+
+def warm_auth_cache():
+    """Loads registered users into the cache so the first taps after startup stay off disk."""
+    rows = db.query_all("SELECT nfc_id, name, subscription_valid_until, valid_until_day FROM users LIMIT ?",
+                        (auth_cache.maxsize,))
+    for nfc_id, name, valid_until_str, valid_until_day in rows:
+        auth_cache.put(nfc_id, make_auth_entry(name, valid_until_str, valid_until_day))
+    print(f"Authorization cache warmed with {auth_cache.stats()['size']} users.")
+
+def get_auth_entry(uid):
+    """Returns (name, valid_until_str, valid_until) for a UID, or None if not registered.
+
+    Served from the cache; only a cache miss falls through to the database.
+    """
+    entry = auth_cache.get(uid)
+    if entry is _NOT_CACHED:
+        user = get_tag_by_uid(uid)
+        entry = make_auth_entry(*user) if user else None
+        auth_cache.put(uid, entry)
+    return entry
+
+def is_subscription_active(valid_until, day=None):
+    """Same cutoff as the old datetime comparison: a subscription lapses at the start of its expiry day.
+    `day` is the day of the tap (default today)."""
+    return valid_until > (day or date.today())
+
+
+# --- Scan Log (write-behind) ---
+# Every tap is recorded in the scans table, but not from the request thread:
+# log_scan() only queues the row, and a background writer inserts the queue
+# in batches (one executemany + one transaction) every SCAN_LOG_BATCH_SIZE
+# rows or SCAN_LOG_FLUSH_MS milliseconds, whichever comes first.
+
+SCAN_LOG_BATCH_SIZE = 100
+SCAN_LOG_FLUSH_MS = 250
+
+class ScanLogWriter:
+    """Background thread that batches scan log rows into the scans table."""
+
+    _STOP = object() # Queued by stop() to make the writer flush and exit
+
+    def __init__(self, batch_size=SCAN_LOG_BATCH_SIZE, flush_ms=SCAN_LOG_FLUSH_MS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.run, name="scan-log-writer", daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout=5):
+        """Writes whatever is still queued and stops the writer thread."""
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(self._STOP)
+            self.thread.join(timeout)
+
+    def log(self, uid, lane, outcome, scanned_at, latency_ms, tap_id=None):
+        self.queue.put(("scan", (uid, lane, outcome, scanned_at, latency_ms, tap_id)))
+
+    def log_meal(self, uid, usage_date):
+        """Queues one served meal for meal_usage (see MealQuota)."""
+        self.queue.put(("meal", (uid, usage_date)))
+
+    def run(self):
+        while True:
+            first = self.queue.get() # Sleep until there is something to write
+            if first is self._STOP:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    row = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if row is self._STOP:
+                    stopping = True
+                    break
+                batch.append(row)
+            self.write(batch)
+            if stopping:
+                return
+
+    def write(self, batch):
+        scans = [row for kind, row in batch if kind == "scan"]
+        counts = {}
+        for uid, lane, outcome, scanned_at, latency_ms, tap_id in scans:
+            key = (str(scanned_at)[:10], lane, outcome)
+            counts[key] = counts.get(key, 0) + 1
+        meals = {}
+        for kind, key in batch:
+            if kind == "meal":
+                meals[key] = meals.get(key, 0) + 1
+        try:
+            with db.transaction() as conn:
+                conn.executemany("""
+                    INSERT INTO scans (uid, lane, outcome, scanned_at, latency_ms, tap_id)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, scans)
+                add_to_rollups(conn, counts) # Same transaction: the rollups never drift from the log
+                conn.executemany("""
+                    INSERT INTO meal_usage (nfc_id, usage_date, meals) VALUES (?, ?, ?)
+                    ON CONFLICT (nfc_id, usage_date) DO UPDATE SET meals = meals + excluded.meals
+                """, [key + (n,) for key, n in meals.items()])
+        except sqlite3.Error as e:
+            print(f"Error writing {len(scans)} scan log rows and {sum(meals.values())} meals: {e}")
+
+scan_log = ScanLogWriter()
+
+def log_scan(uid, lane, outcome, started=None, scanned_at=None, tap_id=None):
+    """Queues a tap for the scan log. `started` is the time.perf_counter() at which handling began."""
+    latency_ms = (time.perf_counter() - started) * 1000 if started is not None else None
+    scan_log.log(uid, lane, outcome, scanned_at or datetime.now().isoformat(timespec="milliseconds"), latency_ms, tap_id)
+
+
+# --- Stats ---
+# scan_daily and scan_weekly hold one counter per period, lane and outcome.
+# The scan log writer adds each batch's counts with an UPSERT in the same
+# transaction as the scans rows, so dashboards read a handful of rows
+# instead of counting the whole scan log.
+
+# Outcome -> name in the /api/stats summary
+STATS_SUMMARY = {"authorized": "served", "expired": "expired", "new": "new_cards"}
+
+def iso_week(day):
+    """'2026-W42' for a date (ISO week, which starts on Monday)."""
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}"
+
+def add_to_rollups(conn, counts):
+    """Adds {(day 'YYYY-MM-DD', lane, outcome): scans} to scan_daily and scan_weekly."""
+    daily = []
+    weekly = {}
+    for (day, lane, outcome), n in counts.items():
+        try:
+            week = iso_week(date.fromisoformat(day))
+        except (TypeError, ValueError):
+            print(f"Skipping {n} scans with an unreadable date ({day!r}) in the rollups")
+            continue
+        daily.append((day, lane, outcome, n))
+        weekly[(week, lane, outcome)] = weekly.get((week, lane, outcome), 0) + n
+    conn.executemany("""
+        INSERT INTO scan_daily (day, lane, outcome, scans) VALUES (?, ?, ?, ?)
+        ON CONFLICT (day, lane, outcome) DO UPDATE SET scans = scans + excluded.scans
+    """, daily)
+    conn.executemany("""
+        INSERT INTO scan_weekly (week, lane, outcome, scans) VALUES (?, ?, ?, ?)
+        ON CONFLICT (week, lane, outcome) DO UPDATE SET scans = scans + excluded.scans
+    """, [key + (n,) for key, n in weekly.items()])
+
+def summarize_outcomes(outcomes):
+    summary = {name: outcomes.get(outcome, 0) for outcome, name in STATS_SUMMARY.items()}
+    summary["outcomes"] = outcomes
+    return summary
+
+def get_scan_stats(period, key):
+    """Counts for one day ('YYYY-MM-DD') or ISO week ('YYYY-Www'), per lane and in total."""
+    if period == "day":
+        rows = db.query_all("SELECT lane, outcome, scans FROM scan_daily WHERE day = ?", (key,))
+    else:
+        rows = db.query_all("SELECT lane, outcome, scans FROM scan_weekly WHERE week = ?", (key,))
+    lanes = {}
+    total = {}
+    for lane, outcome, n in rows:
+        lanes.setdefault(lane, {})[outcome] = n
+        total[outcome] = total.get(outcome, 0) + n
+    return {
+        period: key,
+        "lanes": {lane: summarize_outcomes(outcomes) for lane, outcomes in sorted(lanes.items())},
+        "total": summarize_outcomes(total),
+    }
 
 # Initialize the database when the app starts
 init_db()
+warm_auth_cache()
+scan_log.start()
+atexit.register(scan_log.stop) # Runs before db.close_all (atexit is last-in, first-out)
+
+# --- Static Assets ---
+# Pages load socket.io, Tailwind and the favicon through asset_url(). After
+# `python assets.py` that is /assets/<name>.<hash>.<ext>, served from
+# memory with gzip/brotli picked from Accept-Encoding, a strong ETag and a
+# one-year immutable Cache-Control, so a rebooting kiosk needs neither the
+# internet nor a round trip per file. Until the assets are built the pages
+# load the committed copies in static/vendor/ (and /static for our own
+# files) as they are; the CDN is only used for a vendor file that is missing.
+
+ASSET_MAX_AGE = 365 * 24 * 3600 # Hashed names never change content
+FAVICON_MAX_AGE = 24 * 3600 # /favicon.ico keeps its name, so browsers must recheck it now and then
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"} # In order of preference
+
+class AssetStore:
+    """The built assets, read into memory once: hashed file name -> {"name", "hash", "mimetype", "bodies"}."""
+
+    def __init__(self, dist_dir=assets.DIST_DIR):
+        self.dist_dir = dist_dir
+        self.manifest = {}
+        self.files = {}
+
+    def load(self):
+        try:
+            with open(os.path.join(self.dist_dir, "manifest.json")) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            print("Static assets are not built (python assets.py); pages use static/vendor/ as is.")
+            return
+        files = {}
+        for name, entry in manifest.items():
+            bodies = {}
+            try:
+                for encoding in [None] + entry["encodings"]:
+                    suffix = ENCODING_SUFFIXES.get(encoding, "")
+                    with open(os.path.join(self.dist_dir, entry["file"] + suffix), "rb") as f:
+                        bodies[encoding] = f.read()
+            except OSError as e:
+                print(f"Skipping asset {name}: {e}")
+                continue
+            files[entry["file"]] = {"name": name, "hash": entry["hash"], "bodies": bodies,
+                                    "mimetype": mimetypes.guess_type(name)[0] or "application/octet-stream"}
+        self.manifest = {files[f]["name"]: f for f in files}
+        self.files = files
+
+    def url(self, name):
+        """Where a page should load an asset from."""
+        if name in self.manifest:
+            return url_for("asset", filename=self.manifest[name])
+        if name in assets.VENDOR:
+            if os.path.exists(os.path.join(assets.VENDOR_DIR, name)):
+                return url_for("static", filename=f"vendor/{name}")
+            return assets.VENDOR[name]
+        return url_for("static", filename=name)
+
+    def response(self, file_name, max_age=ASSET_MAX_AGE, immutable=True):
+        """The best encoding of a built file the client accepts (304 if it has it), or None if unknown."""
+        entry = self.files.get(file_name)
+        if entry is None:
+            return None
+        encoding = next((e for e in ENCODING_SUFFIXES
+                         if e in entry["bodies"] and request.accept_encodings.quality(e) > 0), None)
+        # Each encoding is a different representation, so it gets its own strong ETag
+        tag = entry["hash"] + (f"-{encoding}" if encoding else "")
+        if tag in request.if_none_match:
+            response = app.response_class(status=304)
+        else:
+            response = app.response_class(entry["bodies"][encoding], mimetype=entry["mimetype"])
+            if encoding:
+                response.headers["Content-Encoding"] = encoding
+        response.set_etag(tag)
+        response.headers["Vary"] = "Accept-Encoding"
+        response.headers["Cache-Control"] = f"public, max-age={max_age}" + (", immutable" if immutable else "")
+        return response
+
+asset_store = AssetStore()
+asset_store.load()
+app.jinja_env.globals["asset_url"] = asset_store.url
+
+@app.route("/assets/<filename>")
+def asset(filename):
+    response = asset_store.response(filename)
+    if response is None:
+        return jsonify({"message": f"No asset {filename}", "status": "not_found"}), 404
+    return response
+
 
 # --- Flask Routes ---
 
 # Favicon route
 @app.route('/favicon.ico')
 def favicon():
-    # Assuming you have a static folder with a favicon.ico file
+    # Built favicon (compressed, strong ETag) if there is one, else the file in static/
+    if "favicon.ico" in asset_store.manifest:
+        return asset_store.response(asset_store.manifest["favicon.ico"], max_age=FAVICON_MAX_AGE, immutable=False)
     return send_from_directory(os.path.join(app.root_path, 'static'),
-                               'favicon.ico', mimetype='image/vnd.microsoft.icon')
+                               'favicon.ico', mimetype='image/vnd.microsoft.icon', max_age=FAVICON_MAX_AGE)
 
 # Homepage - Displays user list and the dynamic status area
 @app.route("/", methods=["GET", "POST"])
 def index():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-
     if request.method == "POST":
         if 'add' in request.form:
             # Handle adding a new tag from the debug panel
             nfc_id = request.form["nfc_id"]
             name = request.form["name"]
-            valid_until = (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d") # Default 30 days
+            valid_until = (datetime.now() + timedelta(days=SUBSCRIPTION_TERM_DAYS)).strftime("%Y-%m-%d") # Default 30 days
 
             if add_user(nfc_id, name, valid_until):
                 flash(f"Tag {nfc_id} registered for {name}!", "success")
@@ -204,11 +1039,10 @@ def index():
         return redirect(url_for('index'))
 
     # GET request: Display the page
-    cursor.execute("SELECT id, nfc_id, name FROM users") # Fetch id for update form
-    tags = cursor.fetchall()
-    conn.close()
+    # The user list is no longer rendered here; the page loads it page by page from /api/users
     # Render index.html - this template will need JavaScript to handle SocketIO updates
-    return render_template("index.html", tags=tags)
+    # Several workers: a polling Socket.IO session must keep hitting the same worker, so use WebSocket only
+    return render_template("index.html", websocket_only=WORKERS > 1)
 
 # Subscribe new UID page (This route is now primarily for manual registration if needed,
 # as the scanner no longer redirects the browser)
@@ -217,7 +1051,7 @@ def subscribe(uid):
     if request.method == "POST":
         name = request.form["name"]
         # Calculate expiry date 30 days from now
-        valid_until = (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d")
+        valid_until = (datetime.now() + timedelta(days=SUBSCRIPTION_TERM_DAYS)).strftime("%Y-%m-%d")
 
         if add_user(uid, name, valid_until):
              flash(f"Welcome {name}, your subscription is now active until {valid_until}!", "success")
@@ -231,7 +1065,7 @@ def subscribe(uid):
 
     # GET request: Show the subscription form
     # Check if UID already exists before showing the form
-    user = get_tag_by_uid(uid)
+    user = get_auth_entry(uid)
     if user:
         flash(f"UID {uid} is already registered for {user[0]}.", "warning")
         return redirect(url_for("index"))
@@ -244,25 +1078,25 @@ def subscribe(uid):
 # as the scanner no longer redirects the browser)
 @app.route("/welcome/<uid>")
 def welcome(uid):
-    user = get_tag_by_uid(uid)
+    lane = get_lane(request.args.get("lane")) # The page goes back to / once the card leaves this lane's reader
+    user = get_auth_entry(uid)
     if user:
-        name, valid_until_str = user
+        name, valid_until_str, valid_until = user
         # Check if valid_until_str is not None and is a valid date string
         if valid_until_str:
-            try:
-                valid_until = datetime.strptime(valid_until_str, "%Y-%m-%d")
-                if valid_until >= datetime.now():
-                    foods = get_foods() # Note: get_foods() is not implemented to return daily food
-                    # Render welcome.html - this page is for manual access via the browser
-                    # You might want to pass the daily food info here instead of all foods
-                    return render_template("welcome.html", name=name, foods=foods)
-                else:
-                    flash(f"Your subscription for {name} expired on {valid_until_str}.", "danger")
-                    return redirect(url_for("index"))
-            except ValueError:
+            if valid_until is None:
                  # Handle case where date string is invalid
                 flash(f"Invalid subscription date format for user {name}.", "danger")
                 return redirect(url_for("index"))
+            if is_subscription_active(valid_until):
+                food_info = get_current_food_info()
+                foods = [(ret["navn"], ret["billede"]) for ret in food_info["retter"]] if food_info else []
+                # Render welcome.html - this page is for manual access via the browser
+                return render_template("welcome.html", name=name, foods=foods, uid=uid, lane=lane,
+                                       websocket_only=WORKERS > 1) # See index()
+            else:
+                flash(f"Your subscription for {name} expired on {valid_until_str}.", "danger")
+                return redirect(url_for("index"))
         else:
              # Handle case where valid_until is NULL in DB
             flash(f"No subscription date found for user {name}.", "danger")
@@ -273,79 +1107,487 @@ def welcome(uid):
         return redirect(url_for("index"))
 
 
-# --- API Endpoints for Scanner ---
+# --- Lanes ---
+# Each NFC reader is a serving lane with its own kiosk display. The scanner
+# sends the lane with every scan, and results are only emitted into that
+# lane's Socket.IO room, so one display never shows another lane's taps.
+# Displays pick their lane with ?lane=<id> in the page URL.
 
-@app.route("/api/scan", methods=["POST"])
-def api_scan():
-    """
-    Receives scan data from scanner.py.
-    Processes the UID, determines status, and emits a SocketIO event.
-    Returns a simple JSON response to scanner.py.
+DEFAULT_LANE = "1" # Used when a scan or a display doesn't say which lane it belongs to
+
+def get_lane(value):
+    """Normalizes a lane ID from a request (missing -> DEFAULT_LANE)."""
+    return str(value) if value else DEFAULT_LANE
+
+def lane_room(lane):
+    return f"lane:{lane}"
+
+def emit_scan_result(lane, result_data):
+    """Queues a scan_result for the displays of a single lane (sent by the emit queue's thread)."""
+    emit_queue.put(lane, result_data)
+
+
+# --- Lane State ---
+# The server remembers the latest scan_result of every lane. A display that
+# (re)connects gets that state sent to it alone, instead of every display
+# being reset to 'waiting'. Each event carries a per-lane sequence number
+# (plus an epoch that changes when the server restarts), so a display can
+# drop events older than what it already shows.
+
+LANE_STATE_TTL = 120 # Seconds; an older state is not replayed to a connecting display
+
+class LaneStates:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Changes on every server start; workers share the one their parent picked
+        self.epoch = int(os.environ.get("KANTINE_EPOCH") or time.time() * 1000)
+        self.seq = {} # lane -> last sequence number handed out
+        self.states = {} # lane -> (time.monotonic(), latest payload)
+
+    def update(self, lane, result_data, seq=None, store=True):
+        """Stamps the event with lane, epoch and a sequence number and stores it as the current state.
+
+        `seq` is the event's bus ID when running several workers (one order
+        for all of them); otherwise the lane's next local number is used.
+        With store=False the event only takes a number (presence-only events).
+        """
+        with self.lock:
+            last = self.seq.get(lane, 0)
+            if seq is None:
+                seq = last + 1
+            payload = dict(result_data, lane=lane, seq=seq, epoch=self.epoch)
+            if seq > last: # An older event from another worker doesn't replace a newer state
+                self.seq[lane] = seq
+                if store:
+                    self.states[lane] = (time.monotonic(), payload)
+        return payload
+
+    def snapshot(self, lane):
+        """The lane's current state for a connecting display ('waiting' if nothing recent happened)."""
+        with self.lock:
+            stored_at, payload = self.states.get(lane, (None, None))
+            if payload is not None and time.monotonic() - stored_at <= LANE_STATE_TTL:
+                return payload
+            return {
+                "authorized": False,
+                "message": "Waiting for scan...",
+                "name": None,
+                "status": "waiting", # Indicate initial waiting state
+                "uid": None,
+                "lane": lane,
+                "seq": self.seq.get(lane, 0),
+                "epoch": self.epoch,
+            }
+
+lane_states = LaneStates()
+
+
+# --- Presence ---
+# Whether a card is on a lane's reader right now, for welcome.html: a tap
+# with a UID puts it there, scanner.py's /api/remove takes it off. The state
+# follows the lane's scan_result events (so it is also right with several
+# workers) and changes are pushed to screens in the lane's presence room.
+# Screens without Socket.IO long-poll /api/present instead.
+
+PRESENCE_STATUSES = {"authorized", "expired", "already_served", "new"} # Results of a card that is on the reader
+PRESENT_WAIT_MAX = 30 # Longest ?wait= on /api/present (seconds)
+
+def presence_room(lane):
+    return f"presence:{lane}"
+
+class LanePresence:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.states = {} # lane -> {"lane", "present", "uid", "version", "epoch"}
+        self.seq = {} # lane -> seq of the last event applied (events can arrive out of order across workers)
+
+    def get(self, lane):
+        with self.condition:
+            return self.states.get(lane) or {"lane": lane, "present": False, "uid": None,
+                                             "version": 0, "epoch": lane_states.epoch}
+
+    def update(self, payload):
+        """Applies a stamped scan_result. Returns the new state if presence changed, else None."""
+        status = payload.get("status")
+        if status == "removed":
+            present, uid = False, None
+        elif status in PRESENCE_STATUSES | {"present"} and payload.get("uid"):
+            present, uid = True, payload["uid"]
+        else:
+            return None # 'processing', errors etc. say nothing about the reader
+        lane = payload["lane"]
+        with self.condition:
+            if payload["seq"] <= self.seq.get(lane, 0):
+                return None
+            self.seq[lane] = payload["seq"]
+            current = self.get(lane)
+            if (current["present"], current["uid"]) == (present, uid):
+                return None
+            state = {"lane": lane, "present": present, "uid": uid, "version": payload["seq"], "epoch": payload["epoch"]}
+            self.states[lane] = state
+            self.condition.notify_all()
+            return state
+
+    def wait(self, lane, version, timeout):
+        """Blocks until the lane's presence is no longer at `version` (or the timeout passes); returns the state."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.get(lane)["version"] != version, timeout)
+            return self.get(lane)
+
+lane_presence = LanePresence()
+
+
+# --- Emit Queue ---
+# Socket.IO emits used to run inside the HTTP handler, so the scanner's reply
+# waited for the fan-out to every display. Now handlers only queue the event
+# and a background thread does the emitting. A queued 'processing' event is
+# dropped when the same lane's result is queued before it went out: the
+# display would only have flashed it for a moment anyway. 'present' events
+# (a repeat tap answered from the dedup table) go through the same queue to
+# keep their order with the taps, but only change presence: the displays
+# keep showing the first tap's result.
+
+PRESENCE_ONLY_STATUSES = {"present"}
+
+class EmitQueue:
+    """Background sender of scan_result events, with coalescing of superseded 'processing' events."""
+
+    def __init__(self):
+        self.pending = [] # (lane, result_data, bus event ID or None), oldest first
+        self.condition = threading.Condition()
+        self.thread = None
+        self.coalesced = 0 # 'processing' events dropped because their result was already queued
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.run, name="emit-queue", daemon=True)
+            self.thread.start()
+
+    def put(self, lane, result_data, event_id=None):
+        """Queues an event; `event_id` is set for events that came from another worker over the bus."""
+        with self.condition:
+            if result_data.get("status") not in ("processing", *PRESENCE_ONLY_STATUSES):
+                before = len(self.pending)
+                self.pending = [(l, d, e) for l, d, e in self.pending
+                                if not (l == lane and d.get("status") == "processing")]
+                self.coalesced += before - len(self.pending)
+            self.pending.append((lane, result_data, event_id))
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                batch, self.pending = self.pending, []
+            for lane, result_data, event_id in batch:
+                try:
+                    if event_id is None:
+                        # Ours: tell the other workers' displays too (the bus ID orders events across workers)
+                        event_id = event_bus.publish("scan_result", {"lane": lane, "data": result_data})
+                    presence_only = result_data.get("status") in PRESENCE_ONLY_STATUSES
+                    payload = lane_states.update(lane, result_data, event_id, store=not presence_only)
+                    if not presence_only:
+                        socketio.emit('scan_result', payload, to=lane_room(lane))
+                        if payload.get("tap_id") and payload["status"] != "processing":
+                            flight_recorder.record(payload["tap_id"], "emitted")
+                    presence = lane_presence.update(payload)
+                    if presence is not None:
+                        socketio.emit('presence', presence, to=presence_room(lane))
+                except Exception as e:
+                    print(f"Error emitting scan_result to lane {lane}: {e}")
+                    continue
+                if presence_only:
+                    continue
+                EMITS.labels(lane).inc()
+                EMIT_RECIPIENTS.labels(lane).inc(CLIENTS.labels(lane).value)
+
+emit_queue = EmitQueue()
+EMITS_COALESCED = Counter("kantine_socketio_emits_coalesced_total", "'processing' events dropped because the result was ready first",
+                          function=lambda: emit_queue.coalesced)
+emit_queue.start()
+
+
+# --- Tap Tracing ---
+# Every tap carries a correlation ID (tap_id) from scanner.py, where the card
+# was detected, through /api/scan into its scan_result events, and the
+# displays send it back in a scan_ack once they have shown the result. The
+# flight recorder keeps the wall-clock time (ms) of each phase for the last
+# TAP_TRACE_SIZE taps, so /api/debug/taps shows where a slow tap lost its time.
+# Scanner and server share a clock (same machine); display acks are timed on arrival.
+
+TAP_PHASES = ("detected", "uid_read", "sent", "received", "decided", "emitted", "rendered")
+SCANNER_PHASES = TAP_PHASES[:3] # Reported by scanner.py in the /api/scan body
+TAP_TRACE_SIZE = 500
+
+def now_ms():
+    return time.time() * 1000
+
+class FlightRecorder:
+    """Ring buffer of the last `maxsize` tap traces: tap_id -> {"uid", "lane", "status", "phases", "acks"}."""
+
+    def __init__(self, maxsize=TAP_TRACE_SIZE):
+        self.maxsize = maxsize
+        self.traces = OrderedDict()
+        self.lock = threading.Lock()
+
+    def start(self, tap_id, uid, lane, scanner_trace=None):
+        """Opens a trace at 'received', with the phases scanner.py timed before sending."""
+        with self.lock:
+            self.traces[tap_id] = {"tap_id": tap_id, "uid": uid, "lane": lane, "status": None, "phases": {}, "acks": 0}
+            while len(self.traces) > self.maxsize:
+                self.traces.popitem(last=False)
+        scanner_trace = scanner_trace if isinstance(scanner_trace, dict) else {}
+        for phase in SCANNER_PHASES:
+            if isinstance(scanner_trace.get(phase), (int, float)):
+                self.record(tap_id, phase, scanner_trace[phase])
+        self.record(tap_id, "received")
+
+    def record(self, tap_id, phase, at=None, status=None):
+        """Stamps a phase of a tap (the first stamp wins). Returns False if the tap isn't in the buffer."""
+        at = now_ms() if at is None else at
+        with self.lock:
+            trace = self.traces.get(tap_id)
+            if trace is None:
+                return False
+            if status is not None:
+                trace["status"] = status
+            if phase == "rendered":
+                trace["acks"] += 1 # One per display that showed the result
+            phases = trace["phases"]
+            if phase in phases:
+                return True
+            phases[phase] = at
+            previous = [phases[p] for p in TAP_PHASES[:TAP_PHASES.index(phase)] if p in phases]
+        if previous and at >= previous[-1]:
+            TAP_PHASE_SECONDS.labels(phase).observe((at - previous[-1]) / 1000)
+        return True
+
+    def __contains__(self, tap_id):
+        with self.lock:
+            return tap_id in self.traces
+
+    def recent(self, limit):
+        """The newest `limit` traces, newest first, with the time between consecutive phases."""
+        with self.lock:
+            traces = [dict(t, phases={p: round(at, 1) for p, at in t["phases"].items()})
+                      for t in reversed(self.traces.values())][:limit]
+        for trace in traces:
+            stamped = [(p, trace["phases"][p]) for p in TAP_PHASES if p in trace["phases"]]
+            trace["durations_ms"] = {f"{a}->{b}": round(tb - ta, 1) for (a, ta), (b, tb) in zip(stamped, stamped[1:])}
+            trace["total_ms"] = round(stamped[-1][1] - stamped[0][1], 1) if stamped else None
+        return traces
+
+flight_recorder = FlightRecorder()
+
+
+# --- Tap Dedup and Anti-Passback ---
+# A card bouncing on the reader, or seen by two readers at once, used to
+# produce several full scans. Repeats of a UID within TAP_DEDUP_WINDOW
+# seconds now get the first tap's decision back without another lookup or
+# emit. Separately, MEALS_PER_DAY limits how many meals a card is served per
+# day (0 = no limit); meals are counted in meal_usage either way.
+
+TAP_DEDUP_WINDOW = 3.0 # Seconds
+TAP_DEDUP_MAX = 1000 # UIDs remembered at most (oldest dropped first)
+MEALS_PER_DAY = int(os.environ.get("KANTINE_MEALS_PER_DAY", 1))
+MEAL_QUOTA_BUSY_TIMEOUT_MS = 300 # Well below scanner.py's REQUEST_TIMEOUT (2 s), so a locked database can't time the tap out
+
+class TapDedup:
+    """Bounded, expiring map of UID -> (time.monotonic(), reply, HTTP status) of its last full scan."""
+
+    def __init__(self, window=TAP_DEDUP_WINDOW, maxsize=TAP_DEDUP_MAX):
+        self.window = window
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, uid):
+        """The cached (reply, status) if the UID was scanned within the window, else None."""
+        now = time.monotonic()
+        with self.lock:
+            # Entries are in time order, so expired ones are all at the front
+            while self.entries:
+                seen_at = next(iter(self.entries.values()))[0]
+                if now - seen_at <= self.window:
+                    break
+                self.entries.popitem(last=False)
+            entry = self.entries.get(uid)
+            return entry[1:] if entry else None
+
+    def put(self, uid, reply, status_code):
+        with self.lock:
+            self.entries.pop(uid, None)
+            self.entries[uid] = (time.monotonic(), reply, status_code)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def forget(self, uid):
+        with self.lock:
+            self.entries.pop(uid, None)
+
+tap_dedup = TapDedup()
+
+class MealQuota:
+    """Meals served per UID today, mirrored in the meal_usage table.
+
+    claim() checks and counts in memory under one lock, so two lanes can't
+    both serve the last meal, and the tap never waits for the disk: the row
+    is bumped with an UPSERT by the scan log writer. With several workers
+    each has its own map, so the shared row decides instead, with a
+    conditional UPSERT that gives up on the write lock after
+    MEAL_QUOTA_BUSY_TIMEOUT_MS. The map starts over at midnight and is
+    reloaded from meal_usage at startup, so a restart mid-lunch keeps
+    today's counts. Taps from another day (replayed from the scanner's
+    offline queue) are decided by that day's row alone.
     """
-    data = request.json
-    uid = data.get("uid")
 
-    if not uid:
-        # Emit error status via SocketIO
-        socketio.emit('scan_result', {
-            "authorized": False,
-            "message": "Scan Error: No UID received.",
-            "name": None,
-            "status": "error",
-            "uid": None
-        })
-        print("Received scan request with no UID.")
-        # Return a simple JSON response as scanner.py doesn't use the redirect_url anymore
-        return jsonify({"message": "No UID provided", "status": "error"}), 400
+    def __init__(self, limit=MEALS_PER_DAY):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.day = None
+        self.counts = {}
 
-    print(f"Received scan request for UID: {uid}")
+    def _roll_over(self):
+        """Switches the map to today (caller holds the lock)."""
+        today = date.today()
+        if today == self.day:
+            return today
+        self.day = today
+        try:
+            rows = db.query_all("SELECT nfc_id, meals FROM meal_usage WHERE usage_date = ?", (today.isoformat(),))
+        except sqlite3.Error as e:
+            print(f"Error loading today's meal usage: {e}")
+            rows = []
+        self.counts = dict(rows)
+        return today
 
-    # Emit processing status via SocketIO immediately
-    socketio.emit('scan_result', {
-        "authorized": False, # Not yet authorized
-        "message": f"Processing UID: {uid}...",
-        "name": None,
-        "status": "processing",
-        "uid": uid
-    })
+    def load(self):
+        with self.lock:
+            self.day = None
+            self._roll_over()
 
-    user = get_tag_by_uid(uid)
+    def _claim_row(self, uid, day, busy_timeout_ms=None):
+        """Bumps the UID's meal_usage row for `day` unless it is at the limit. Returns False if it was."""
+        with db.transaction(busy_timeout_ms=busy_timeout_ms) as conn:
+            return conn.execute("""
+                INSERT INTO meal_usage (nfc_id, usage_date, meals) VALUES (?, ?, 1)
+                ON CONFLICT (nfc_id, usage_date) DO UPDATE SET meals = meals + 1
+                WHERE ? = 0 OR meals < ?
+            """, (uid, day.isoformat(), self.limit, self.limit)).rowcount > 0
+
+    def claim(self, uid, day=None):
+        """Counts a meal for the UID on `day` (default today). Returns False (and counts nothing) if the daily limit is reached."""
+        with self.lock:
+            today = self._roll_over()
+            if day is None:
+                day = today
+        if day != today:
+            try:
+                return self._claim_row(uid, day)
+            except sqlite3.Error as e:
+                print(f"Error saving meal usage for UID {uid} on {day}: {e}")
+                return True
+        with self.lock:
+            served = self.counts.get(uid, 0)
+            if self.limit and served >= self.limit:
+                return False
+            self.counts[uid] = served + 1
+        if WORKERS == 1:
+            scan_log.log_meal(uid, today.isoformat())
+            return True
+        try:
+            changed = self._claim_row(uid, today, busy_timeout_ms=MEAL_QUOTA_BUSY_TIMEOUT_MS)
+        except sqlite3.Error as e:
+            # Served on this worker's count alone (e.g. a roster import holds the write lock); saved later
+            print(f"Error saving meal usage for UID {uid}: {e}")
+            scan_log.log_meal(uid, today.isoformat())
+            return True
+        if not changed: # Another worker served the last meal first
+            with self.lock:
+                self.counts[uid] = self.limit
+            return False
+        return True
+
+meal_quota = MealQuota()
+meal_quota.load()
+
+
+# --- Worker Events ---
+# What other workers publish on the bus (see bus.py). Caches are only
+# invalidated, not updated, so the next lookup reads the committed row. The
+# tap dedup table is the exception: it holds decisions, not rows.
+
+def on_remote_scan_result(event_id, event):
+    emit_queue.put(event["lane"], event["data"], event_id)
+
+def on_remote_user_changed(event_id, event):
+    for uid in event["uids"]:
+        auth_cache.invalidate(uid)
+        tap_dedup.forget(uid)
+
+def on_remote_cache_reload(event_id, event):
+    auth_cache.clear()
+    warm_auth_cache()
+
+def on_remote_menu_changed(event_id, event):
+    today_menu.invalidate()
+
+def on_remote_scanner_status(event_id, event):
+    parent_scanner_status.update(event)
+
+def on_remote_tap_decided(event_id, event):
+    tap_dedup.put(event["uid"], event["reply"], event["status_code"])
+
+def on_remote_metrics(event_id, event):
+    worker_metrics[event["worker"]] = event["metrics"]
+
+def on_remote_scan_ack(event_id, event):
+    flight_recorder.record(event["tap_id"], "rendered", event["at"])
+
+event_bus.subscribe("scan_result", on_remote_scan_result)
+event_bus.subscribe("user_changed", on_remote_user_changed)
+event_bus.subscribe("cache_reload", on_remote_cache_reload)
+event_bus.subscribe("menu_changed", on_remote_menu_changed)
+event_bus.subscribe("scan_ack", on_remote_scan_ack)
+event_bus.subscribe("tap_decided", on_remote_tap_decided)
+event_bus.subscribe("scanner_status", on_remote_scanner_status)
+event_bus.subscribe("metrics", on_remote_metrics)
+event_bus.start()
+
+# A scrape of the shared port reaches one worker; it answers for all of them
+# (each series labelled worker="N"), from what the others published last
+METRICS_PUBLISH_INTERVAL = 5 # Seconds
+worker_metrics = {} # worker ID -> its last metrics.collect()
+
+def run_metrics_publisher():
+    while True:
+        time.sleep(METRICS_PUBLISH_INTERVAL)
+        try:
+            event_bus.publish("metrics", {"worker": WORKER_ID, "metrics": metrics.collect({"worker": WORKER_ID})})
+        except sqlite3.Error as e:
+            print(f"Error publishing metrics: {e}")
+
+if WORKERS > 1:
+    threading.Thread(target=run_metrics_publisher, name="metrics-publisher", daemon=True).start()
+
+
+# --- Scan Decisions ---
+
+def authorize_scan(uid, day=None):
+    """
+    Decides what a tap with this UID means (authorized / expired / new / error).
+    `day` is the day of the tap for replayed taps; subscription and meal quota are checked against it.
+    Returns (result_data for the displays, JSON reply for the scanner, HTTP status).
+    """
+    user = get_auth_entry(uid) # Served from the in-memory authorization cache
     food_info = get_current_food_info() # Get daily food info
 
     if user:
-        name, valid_until_str = user
+        name, valid_until_str, valid_until = user
         # Check if valid_until_str is not None and is a valid date string
         if valid_until_str:
-            try:
-                valid_until = datetime.strptime(valid_until_str, "%Y-%m-%d")
-                if valid_until >= datetime.now():
-                    # Authorized user
-                    result_data = {
-                        "authorized": True,
-                        "name": name,
-                        "message": f"Access Granted: {name}",
-                        "status": "authorized",
-                        "uid": uid,
-                        "food_info": food_info # Include food info
-                    }
-                    print(f"UID {uid} is authorized: {name}")
-                    socketio.emit('scan_result', result_data) # Emit authorized status
-                    # Return a simple JSON response
-                    return jsonify({"message": f"Access Granted: {name}", "status": "authorized", "name": name}), 200
-                else:
-                    # Subscription expired
-                    result_data = {
-                        "authorized": False,
-                        "name": name,
-                        "message": f"Subscription Expired for {name}.",
-                        "status": "expired",
-                        "uid": uid
-                    }
-                    print(f"UID {uid} subscription expired: {name}")
-                    socketio.emit('scan_result', result_data) # Emit expired status
-                    # Return a simple JSON response
-                    return jsonify({"message": f"Subscription Expired for {name}", "status": "expired", "name": name}), 403 # Forbidden
-            except ValueError:
+            if valid_until is None:
                  # Handle invalid date format in DB
                 result_data = {
                     "authorized": False,
@@ -355,9 +1597,41 @@ def api_scan():
                     "uid": uid
                 }
                 print(f"UID {uid} has invalid date format.")
-                socketio.emit('scan_result', result_data) # Emit error status
-                # Return a simple JSON response
-                return jsonify({"message": f"Error: Invalid date format for {name}", "status": "error"}), 500 # Internal Server Error
+                return result_data, {"message": f"Error: Invalid date format for {name}", "status": "error"}, 500 # Internal Server Error
+            if is_subscription_active(valid_until, day) and not meal_quota.claim(uid, day):
+                # Anti-passback: this card already got its meal(s) today
+                result_data = {
+                    "authorized": False,
+                    "name": name,
+                    "message": f"{name} has already been served today.",
+                    "status": "already_served",
+                    "uid": uid
+                }
+                print(f"UID {uid} already served today: {name}")
+                return result_data, {"message": f"Already served today: {name}", "status": "already_served", "name": name}, 403 # Forbidden
+            if is_subscription_active(valid_until, day):
+                # Authorized user
+                result_data = {
+                    "authorized": True,
+                    "name": name,
+                    "message": f"Access Granted: {name}",
+                    "status": "authorized",
+                    "uid": uid,
+                    "food_info": food_info # Include food info
+                }
+                print(f"UID {uid} is authorized: {name}")
+                return result_data, {"message": f"Access Granted: {name}", "status": "authorized", "name": name}, 200
+            else:
+                # Subscription expired
+                result_data = {
+                    "authorized": False,
+                    "name": name,
+                    "message": f"Subscription Expired for {name}.",
+                    "status": "expired",
+                    "uid": uid
+                }
+                print(f"UID {uid} subscription expired: {name}")
+                return result_data, {"message": f"Subscription Expired for {name}", "status": "expired", "name": name}, 403 # Forbidden
         else:
              # Handle NULL valid_until in DB
             result_data = {
@@ -368,9 +1642,7 @@ def api_scan():
                 "uid": uid
             }
             print(f"UID {uid} has no subscription date.")
-            socketio.emit('scan_result', result_data) # Emit error status
-            # Return a simple JSON response
-            return jsonify({"message": f"Error: No subscription date for {name}", "status": "error"}), 500 # Internal Server Error
+            return result_data, {"message": f"Error: No subscription date for {name}", "status": "error"}, 500 # Internal Server Error
 
 
     else:
@@ -385,19 +1657,156 @@ def api_scan():
             "redirect_url": url_for('subscribe', uid=uid) # Kept for info, not used for redirect by scanner
         }
         print(f"UID {uid} is new.")
-        socketio.emit('scan_result', result_data) # Emit new card status
-        # Return a simple JSON response
-        return jsonify({"message": "New card detected. Please register.", "status": "new", "uid": uid}), 404 # Not Found
+        return result_data, {"message": "New card detected. Please register.", "status": "new", "uid": uid}, 404 # Not Found
+
+
+# --- API Endpoints for Scanner ---
+
+@app.route("/api/scan", methods=["POST"])
+def api_scan():
+    """
+    Receives scan data from scanner.py.
+    Processes the UID, determines status, and emits a SocketIO event.
+    Returns a simple JSON response to scanner.py.
+    """
+    started = time.perf_counter()
+    data = request.json
+    uid = data.get("uid")
+    lane = get_lane(data.get("lane"))
+    # Correlation ID from scanner.py (older scanners don't send one)
+    tap_id = str(data.get("tap_id") or uuid.uuid4().hex[:16])
+    flight_recorder.start(tap_id, uid, lane, data.get("trace"))
+
+    if not uid:
+        # Emit error status via SocketIO
+        emit_scan_result(lane, {
+            "authorized": False,
+            "message": "Scan Error: No UID received.",
+            "name": None,
+            "status": "error",
+            "uid": None,
+            "tap_id": tap_id
+        })
+        print("Received scan request with no UID.")
+        log_scan(None, lane, "error", started, tap_id=tap_id)
+        SCAN_SECONDS.labels("error").observe(time.perf_counter() - started)
+        # Return a simple JSON response as scanner.py doesn't use the redirect_url anymore
+        return jsonify({"message": "No UID provided", "status": "error", "tap_id": tap_id}), 400
+
+    print(f"Received scan request for UID: {uid} (lane {lane}, tap {tap_id})")
+    scanner_supervisor.record_tap()
+
+    repeat = tap_dedup.get(uid)
+    if repeat is not None:
+        # Same card again within the dedup window: answer with the first decision, no lookup, no new result
+        reply, status_code = repeat
+        print(f"UID {uid} repeated within {TAP_DEDUP_WINDOW}s, reusing decision '{reply['status']}'.")
+        # No new result for the displays, but the card is on this lane's reader (again)
+        emit_scan_result(lane, {"status": "present", "uid": uid, "tap_id": tap_id})
+        log_scan(uid, lane, "duplicate", started, tap_id=tap_id)
+        flight_recorder.record(tap_id, "decided", status="duplicate")
+        SCAN_SECONDS.labels("duplicate").observe(time.perf_counter() - started)
+        return jsonify(dict(reply, tap_id=tap_id)), status_code
+
+    # Emit processing status via SocketIO immediately
+    emit_scan_result(lane, {
+        "authorized": False, # Not yet authorized
+        "message": f"Processing UID: {uid}...",
+        "name": None,
+        "status": "processing",
+        "uid": uid,
+        "tap_id": tap_id
+    })
+
+    result_data, reply, status_code = authorize_scan(uid)
+    flight_recorder.record(tap_id, "decided", status=result_data["status"])
+    tap_dedup.put(uid, reply, status_code)
+    # The next tap of this card may land on another worker: it must get this decision too
+    event_bus.publish("tap_decided", {"uid": uid, "reply": reply, "status_code": status_code})
+    emit_scan_result(lane, dict(result_data, tap_id=tap_id))
+    log_scan(uid, lane, result_data["status"], started, tap_id=tap_id)
+    SCAN_SECONDS.labels(result_data["status"]).observe(time.perf_counter() - started)
+    # Return a simple JSON response
+    return jsonify(dict(reply, tap_id=tap_id)), status_code
+
+def scan_day(scanned_at):
+    """The day of a buffered tap's ISO timestamp, or None (today) if it is missing or malformed."""
+    try:
+        return datetime.fromisoformat(scanned_at).date()
+    except (TypeError, ValueError):
+        return None
+
+def tap_handled(tap_id):
+    """True if a tap with this ID already reached the server: live on this worker, or logged by any worker."""
+    if tap_id in flight_recorder:
+        return True
+    return db.query_one("SELECT 1 FROM scans WHERE tap_id = ? LIMIT 1", (tap_id,)) is not None
+
+@app.route("/api/scan/bulk", methods=["POST"])
+def api_scan_bulk():
+    """
+    Receives a batch of taps that scanner.py buffered while the server was unreachable.
+    Body: {"scans": [{"uid": ..., "lane": ..., "scanned_at": ..., "offline_decision": ..., "tap_id": ...}, ...]}
+    Taps whose tap_id was already handled (the live request got through after
+    all, or a batch is sent again) are skipped with status "duplicate". Each other tap gets the decision /api/scan would have given on the day it was
+    scanned (subscription and meal quota of that day), but nothing is emitted to the
+    displays: the students have long since left the reader. If the scanner
+    decided the tap itself (offline_decision), disagreements are reported.
+    """
+    data = request.get_json(silent=True) or {}
+    scans = data.get("scans")
+    if not isinstance(scans, list):
+        return jsonify({"message": "Expected a list of scans", "status": "error"}), 400
+
+    print(f"Received {len(scans)} buffered scans from scanner.")
+    results = []
+    mismatches = 0
+    seen = set() # tap_ids in this batch (their scan log rows aren't written yet)
+    for scan in scans:
+        if not isinstance(scan, dict):
+            results.append({"message": "Scan must be an object", "status": "error", "http_status": 400})
+            continue
+        uid = scan.get("uid")
+        if not uid or not isinstance(uid, str):
+            results.append({"message": "No UID provided", "status": "error", "http_status": 400})
+            continue
+        lane = get_lane(scan.get("lane"))
+        tap_id = scan.get("tap_id")
+        if tap_id is not None:
+            tap_id = str(tap_id)
+            if tap_id in seen or tap_handled(tap_id):
+                print(f"Buffered scan for UID {uid} (tap {tap_id}) was already handled, skipping it.")
+                results.append({"message": "Already handled", "status": "duplicate", "uid": uid, "lane": lane,
+                                "tap_id": tap_id, "http_status": 200})
+                continue
+            seen.add(tap_id)
+        print(f"Replaying buffered scan for UID: {uid} (lane {lane}, scanned at {scan.get('scanned_at')})")
+        result_data, reply, status_code = authorize_scan(uid, day=scan_day(scan.get("scanned_at")))
+        log_scan(uid, lane, result_data["status"], scanned_at=scan.get("scanned_at"), tap_id=tap_id)
+        result = dict(reply, uid=uid, lane=lane, tap_id=tap_id, http_status=status_code)
+        # Reconcile the decision the scanner made offline with ours
+        offline_decision = scan.get("offline_decision")
+        if offline_decision is not None:
+            result["offline_decision"] = offline_decision
+            result["mismatch"] = offline_decision != result_data["status"]
+            if result["mismatch"]:
+                mismatches += 1
+                print(f"Offline decision for UID {uid} was '{offline_decision}', server says '{result_data['status']}'.")
+        results.append(result)
+    return jsonify({"status": "ok", "processed": len(results), "mismatches": mismatches, "results": results}), 200
 
 @app.route("/api/remove", methods=["POST"])
 def api_remove():
     """
     Receives notification from scanner.py when a card is removed.
-    Emits a SocketIO event to update the frontend status.
+    Updates the lane's presence (welcome screens) and clears the kiosk displays,
+    which keep only an open registration form (status 'new') until the name is entered.
     """
-    print("Card removed notification received.")
-    # Emit removed status via SocketIO
-    socketio.emit('scan_result', {
+    data = request.get_json(silent=True) or {}
+    lane = get_lane(data.get("lane"))
+    print(f"Card removed notification received (lane {lane}).")
+    # Queued behind the lane's taps, so it never overtakes the result of the tap before it
+    emit_scan_result(lane, {
         "authorized": False,
         "message": "Card removed. Waiting for scan...",
         "name": None,
@@ -407,6 +1816,33 @@ def api_remove():
     # Return a simple JSON response
     return jsonify({"status": "removed", "message": "Card removed"})
 
+@app.route("/api/present")
+def api_present():
+    """
+    Whether a card is on a lane's reader (?lane=): {"lane", "present", "uid", "version", "epoch"}.
+    Fallback for screens without Socket.IO. Send the ETag back as If-None-Match to get a 304
+    while nothing changed; with ?wait=<seconds> the 304 only comes after waiting that long for a change.
+    """
+    lane = get_lane(request.args.get("lane"))
+    try:
+        wait = min(max(float(request.args.get("wait", 0)), 0), PRESENT_WAIT_MAX)
+    except ValueError:
+        return jsonify({"message": "wait must be a number of seconds", "status": "error"}), 400
+    state = lane_presence.get(lane)
+    tag = f"{state['epoch']}-{state['version']}"
+    if tag in request.if_none_match:
+        if wait:
+            state = lane_presence.wait(lane, state["version"], wait)
+            tag = f"{state['epoch']}-{state['version']}"
+        if tag in request.if_none_match:
+            response = app.response_class(status=304)
+            response.set_etag(tag)
+            return response
+    response = jsonify(state)
+    response.set_etag(tag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
 @app.route("/api/register", methods=["POST"])
 def api_register():
     """
@@ -416,11 +1852,12 @@ def api_register():
     data = request.json
     uid = data.get("uid")
     name = data.get("name")
+    lane = get_lane(data.get("lane")) # Lane of the display the registration was made from
 
     if not uid or not name:
         error_message = "Registration Error: Missing UID or name."
         print(error_message)
-        socketio.emit('scan_result', {
+        emit_scan_result(lane, {
             "authorized": False,
             "message": error_message,
             "name": None,
@@ -432,7 +1869,7 @@ def api_register():
     print(f"Received registration request for UID: {uid}, Name: {name}")
 
     # Calculate expiry date 30 days from now
-    valid_until = (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d")
+    valid_until = (datetime.now() + timedelta(days=SUBSCRIPTION_TERM_DAYS)).strftime("%Y-%m-%d")
 
     if add_user(uid, name, valid_until):
         print(f"User {name} registered successfully with UID {uid}.")
@@ -446,13 +1883,13 @@ def api_register():
             "uid": uid,
             "food_info": food_info # Include food info
         }
-        socketio.emit('scan_result', result_data) # Emit authorized status via SocketIO
+        emit_scan_result(lane, result_data) # Emit authorized status via SocketIO
         return jsonify({"message": "Registration successful", "status": "success", "name": name, "uid": uid}), 200
     else:
         error_message = f"Registration Error: UID {uid} already exists."
         print(error_message)
         # Emit an error status
-        socketio.emit('scan_result', {
+        emit_scan_result(lane, {
             "authorized": False,
             "message": error_message,
             "name": None,
@@ -461,35 +1898,321 @@ def api_register():
         })
         return jsonify({"message": error_message, "status": "error"}), 409 # Conflict
 
+# --- Admin API ---
+
+@app.route("/api/users")
+def api_users():
+    """
+    Returns one page of users as JSON, for the admin list on the index page.
+    Query parameters: after (last id of the previous page), limit, q (name search).
+    """
+    try:
+        after_id = int(request.args.get("after", 0))
+        limit = min(max(int(request.args.get("limit", USERS_PAGE_SIZE)), 1), USERS_PAGE_MAX)
+    except ValueError:
+        return jsonify({"message": "after and limit must be integers", "status": "error"}), 400
+    search = request.args.get("q", "").strip() or None
+
+    rows = list_users(after_id, limit, search)
+    users = [{"id": user_id, "nfc_id": nfc_id, "name": name, "subscription_valid_until": valid_until}
+             for user_id, nfc_id, name, valid_until in rows]
+    # A full page means there may be more; the client passes next_after back as ?after=
+    next_after = users[-1]["id"] if len(users) == limit else None
+    return jsonify({"users": users, "next_after": next_after})
+
+@app.route("/api/users/expiring")
+def api_users_expiring():
+    """Users whose subscription ends within the next ?days= (default 14), soonest first."""
+    try:
+        days = max(int(request.args.get("days", 14)), 0)
+        limit = min(max(int(request.args.get("limit", USERS_PAGE_MAX)), 1), USERS_PAGE_MAX)
+    except ValueError:
+        return jsonify({"message": "days and limit must be integers", "status": "error"}), 400
+    rows = get_expiring_users(days, limit)
+    return jsonify({"users": [{"id": user_id, "nfc_id": nfc_id, "name": name, "subscription_valid_until": valid_until}
+                              for user_id, nfc_id, name, valid_until in rows]})
+
+@app.route("/api/users/renew", methods=["POST"])
+def api_users_renew():
+    """
+    Bulk renewal. Body: who - {"uids": [...]} or {"expiring_within": <days>} or {"all": true};
+    how long - {"days": <n>} (default SUBSCRIPTION_TERM_DAYS, counted from the current expiry) or {"until": "YYYY-MM-DD"}.
+    """
+    data = request.get_json(silent=True) or {}
+    uids = data.get("uids")
+    if uids is not None and not (isinstance(uids, list) and uids and all(isinstance(u, str) for u in uids)):
+        return jsonify({"message": "uids must be a non-empty list of UIDs", "status": "error"}), 400
+    if uids is None and data.get("expiring_within") is None and data.get("all") is not True:
+        return jsonify({"message": "Say who to renew: uids, expiring_within or all", "status": "error"}), 400
+    until = data.get("until")
+    if until is not None:
+        until = parse_valid_until(until)
+        if until is None:
+            return jsonify({"message": "until must be YYYY-MM-DD", "status": "error"}), 400
+    try:
+        expiring_within = int(data["expiring_within"]) if data.get("expiring_within") is not None else None
+        days = int(data.get("days", SUBSCRIPTION_TERM_DAYS))
+    except (TypeError, ValueError):
+        return jsonify({"message": "expiring_within and days must be integers", "status": "error"}), 400
+    renewed = renew_subscriptions(uids, expiring_within, days, until)
+    print(f"Renewed {renewed} subscriptions.")
+    return jsonify({"status": "ok", "renewed": renewed})
+
+@app.route("/api/cache/reload", methods=["POST"])
+def api_cache_reload():
+    """Drops and re-warms the authorization cache, e.g. after a roster import from the command line."""
+    auth_cache.clear()
+    warm_auth_cache()
+    event_bus.publish("cache_reload", {})
+    return jsonify({"status": "ok", "cache": auth_cache.stats()})
+
+@app.route("/api/scanner/status")
+def api_scanner_status():
+    """Shows whether the supervised scanner process is up, for how long, and how often it was restarted."""
+    return jsonify(dict(scanner_status(), worker=WORKER_ID))
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape endpoint. With several workers every series has a worker label (counters reset per worker)."""
+    if WORKERS == 1:
+        return app.response_class(metrics.render(), content_type=metrics.CONTENT_TYPE)
+    others = [collection for worker_id, collection in sorted(worker_metrics.items()) if worker_id != WORKER_ID]
+    return app.response_class(metrics.render([metrics.collect({"worker": WORKER_ID})] + others),
+                              content_type=metrics.CONTENT_TYPE)
+
+@app.route("/api/menu/<menu_date>", methods=["GET", "PUT", "DELETE"])
+def api_menu(menu_date):
+    """
+    Reads, replaces or deletes the menu of a date (YYYY-MM-DD, or 'today').
+    PUT body: {"description": "...", "dishes": [{"name": "...", "image_url": "...", "allergens": ["Gluten"]}]}
+    (allergens may also be a comma-separated string, e.g. "Gluten,Selleri")
+    """
+    if menu_date == "today":
+        menu_date = date.today().isoformat()
+    if parse_valid_until(menu_date) is None:
+        return jsonify({"message": "Date must be YYYY-MM-DD", "status": "error"}), 400
+
+    if request.method == "PUT":
+        data = request.get_json(silent=True) or {}
+        dishes = data.get("dishes") or []
+        if not isinstance(dishes, list) or not all(isinstance(d, dict) and d.get("name") for d in dishes):
+            return jsonify({"message": "Every dish needs a name", "status": "error"}), 400
+        for dish in dishes:
+            allergens = parse_allergens(dish.get("allergens"))
+            if allergens is None:
+                return jsonify({"message": f"Allergens of '{dish['name']}' must be a list of names or a comma-separated string",
+                                "status": "error"}), 400
+            dish["allergens"] = allergens
+        save_menu(menu_date, data.get("description"), dishes)
+    elif request.method == "DELETE":
+        delete_menu(menu_date)
+        return jsonify({"status": "deleted", "dato": menu_date})
+
+    menu = get_menu(menu_date)
+    if menu is None:
+        return jsonify({"message": f"No menu for {menu_date}", "status": "not_found"}), 404
+    return jsonify(menu)
+
+@app.route("/api/stats/day/<day>")
+def api_stats_day(day):
+    """Served meals, expired-card attempts and new cards per lane for a date (YYYY-MM-DD, or 'today')."""
+    if day == "today":
+        day = date.today().isoformat()
+    if parse_valid_until(day) is None:
+        return jsonify({"message": "Date must be YYYY-MM-DD", "status": "error"}), 400
+    return jsonify(get_scan_stats("day", day))
+
+@app.route("/api/stats/week/<week>")
+def api_stats_week(week):
+    """The same for an ISO week (YYYY-Www), or the week of a date (YYYY-MM-DD or 'today')."""
+    if week == "today":
+        week = date.today().isoformat()
+    day = parse_valid_until(week)
+    if day is not None:
+        week = iso_week(day)
+    else:
+        try:
+            week = iso_week(datetime.strptime(week + "-1", "%G-W%V-%u").date()) # Normalizes e.g. 2026-W7
+        except ValueError:
+            return jsonify({"message": "Week must be YYYY-Www or YYYY-MM-DD", "status": "error"}), 400
+    return jsonify(get_scan_stats("week", week))
+
+@app.route("/api/debug/taps")
+def api_debug_taps():
+    """Phase timings of recent taps from the flight recorder (?limit=, default 50), or of one tap (?tap_id=)."""
+    tap_id = request.args.get("tap_id")
+    if tap_id:
+        traces = [t for t in flight_recorder.recent(TAP_TRACE_SIZE) if t["tap_id"] == tap_id]
+        if not traces:
+            return jsonify({"message": f"No trace for tap {tap_id}", "status": "not_found"}), 404
+        return jsonify(traces[0])
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), TAP_TRACE_SIZE)
+    except ValueError:
+        return jsonify({"message": "limit must be an integer", "status": "error"}), 400
+    return jsonify({"taps": flight_recorder.recent(limit), "worker": WORKER_ID})
+
+@app.route("/api/users/changes")
+def api_user_changes():
+    """
+    Delta feed for scanner.py's offline snapshot: users added/changed/deleted since ?since=<version>.
+    Returns {"version": ..., "changes": [{"uid", "valid_until", "deleted"}], "more": bool};
+    call again with since=version while more is true.
+    """
+    try:
+        since = int(request.args.get("since", 0))
+        limit = min(max(int(request.args.get("limit", 1000)), 1), USER_CHANGES_PAGE_MAX)
+    except ValueError:
+        return jsonify({"message": "since and limit must be integers", "status": "error"}), 400
+    rows = get_user_changes(since, limit)
+    changes = []
+    for change_seq, nfc_id, valid_until_str, deleted in rows:
+        valid_until = parse_valid_until(valid_until_str)
+        changes.append({"uid": nfc_id, "valid_until": valid_until.isoformat() if valid_until else None,
+                        "deleted": bool(deleted)})
+    version = rows[-1][0] if rows else since
+    return jsonify({"version": version, "changes": changes, "more": len(rows) == limit})
+
 # --- SocketIO Events ---
 
 @socketio.on('connect')
 def handle_connect():
     """Handler for new SocketIO client connections."""
-    print('SocketIO client connected')
-    # When a new client connects, emit a default 'waiting' status.
-    socketio.emit('scan_result', {
-        "authorized": False,
-        "message": "Waiting for scan...",
-        "name": None,
-        "status": "waiting", # Indicate initial waiting state
-        "uid": None
-    })
+    lane = get_lane(request.args.get('lane'))
+    if request.args.get('view') == 'presence':
+        # welcome.html: only presence changes of its lane, not the scan results
+        join_room(presence_room(lane))
+        emit('presence', lane_presence.get(lane), to=request.sid)
+        return
+    join_room(lane_room(lane)) # Only receive scan results for this display's lane
+    client_lanes[request.sid] = lane
+    CLIENTS.labels(lane).inc()
+    print(f'SocketIO client connected (lane {lane})')
+    # Send only this client the lane's current state; the other displays are left alone
+    emit('scan_result', lane_states.snapshot(lane), to=request.sid)
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handler for SocketIO client disconnections."""
+    lane = client_lanes.pop(request.sid, None)
+    if lane is not None:
+        CLIENTS.labels(lane).dec()
     print('SocketIO client disconnected')
 
+@socketio.on('scan_ack')
+def handle_scan_ack(data):
+    """A display has shown the result of a tap (see Tap Tracing)."""
+    tap_id = data.get("tap_id") if isinstance(data, dict) else None
+    if not tap_id:
+        return
+    at = now_ms()
+    if not flight_recorder.record(tap_id, "rendered", at):
+        # The tap was handled by another worker; its flight recorder has the trace
+        event_bus.publish("scan_ack", {"tap_id": tap_id, "at": at})
+
+
+def run_cli(args):
+    """Handles `python app.py serve ...` (import/export are dispatched at the top, see roster.py). Returns the exit code."""
+    command = args[0]
+    if command == "serve" and len(args) <= 2 and (len(args) == 1 or args[1].isdigit()):
+        return run_workers(int(args[1]) if len(args) == 2 else os.cpu_count() or 1)
+    print("Usage: python app.py import <roster.csv> | python app.py export [roster.csv] | python app.py serve [workers]",
+          file=sys.stderr)
+    return 2
+
+
+# --- Workers ---
+# `python app.py serve N` runs N server processes on one port, so scans and
+# displays are spread over several cores. The parent opens the listening
+# socket and hands it to every worker (the kernel gives each new connection
+# to one of them), picks the epoch they all stamp on scan events, and
+# restarts workers that die. It also supervises the scanner and publishes
+# its status to the workers. Workers keep each other's displays and caches
+# up to date over the event bus.
+
+WORKER_CHECK_INTERVAL = 1 # Seconds between checks for dead workers
+WORKER_STOP_TIMEOUT = 10 # Seconds a worker gets to shut down before it is killed
+
+def run_workers(count):
+    listener = socket.create_server((SERVER_HOST, SERVER_PORT), backlog=128)
+    env = dict(os.environ,
+               KANTINE_WORKERS=str(count),
+               KANTINE_EPOCH=str(int(time.time() * 1000)),
+               KANTINE_LISTEN_FD=str(listener.fileno()))
+
+    def spawn(worker_id):
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__)],
+                                   env=dict(env, KANTINE_WORKER_ID=str(worker_id)),
+                                   pass_fds=(listener.fileno(),))
+        print(f"Worker {worker_id} started (PID {process.pid}).")
+        return process
+
+    signal.signal(signal.SIGTERM, signal.default_int_handler) # A service manager's stop works like Ctrl-C
+    print(f"Serving on http://{SERVER_HOST}:{SERVER_PORT} with {count} workers.")
+    # The scanner belongs to this process, not to a worker: a worker that dies
+    # (even without running atexit) and is restarted can't leave a second scanner behind
+    start_scanner_script()
+    status_bus = bus.EventBus(enabled=True)
+    status_bus.start(listen=False)
+    workers = {worker_id: spawn(worker_id) for worker_id in range(count)}
+    try:
+        while True:
+            time.sleep(WORKER_CHECK_INTERVAL)
+            status_bus.publish("scanner_status", scanner_supervisor.status())
+            for worker_id, process in list(workers.items()):
+                if process.poll() is not None:
+                    print(f"Worker {worker_id} (PID {process.pid}) exited with code {process.returncode}, restarting it.")
+                    workers[worker_id] = spawn(worker_id)
+    except KeyboardInterrupt:
+        print("Stopping workers...")
+    finally:
+        for process in workers.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT) # Like Ctrl-C, so the workers' atexit cleanup runs
+        for process in workers.values():
+            try:
+                process.wait(timeout=WORKER_STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        listener.close()
+    return 0
+
+def run_worker(listen_fd):
+    """Serves on the socket inherited from run_workers() until interrupted."""
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
+    # No reloader or debugger here: the parent owns the process lifecycle
+    server = make_server(SERVER_HOST, SERVER_PORT, app, threaded=True, fd=listen_fd)
+    print(f"Worker {WORKER_ID} (PID {os.getpid()}) serving.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # `serve N` (import/export never get here, see the top of the file)
+        sys.exit(run_cli(sys.argv[1:]))
+
+    if os.environ.get("KANTINE_LISTEN_FD"):
+        # One of the processes started by `python app.py serve N`
+        run_worker(int(os.environ["KANTINE_LISTEN_FD"]))
+        sys.exit(0)
+
     # Start the scanner script before running the Flask-SocketIO app
-    # This ensures the scanner is running when the web server starts
-    start_scanner_script()
+    # This ensures the scanner is running when the web server starts.
+    # With debug=True the reloader runs this file twice (a watcher process and
+    # the actual server); only the server process (WERKZEUG_RUN_MAIN) gets a scanner.
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_scanner_script()
+
+    # Speak HTTP/1.1 so the scanner's keep-alive session reuses one connection
+    # instead of opening a new TCP connection for every tap
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
 
     # Use socketio.run instead of app.run to include the SocketIO server
     # host='0.0.0.0' makes it accessible externally (useful if scanner is on another machine)
     # host='127.0.0.1' restricts it to the local machine (safer for local development)
     print("Starting Flask-SocketIO server...")
-    socketio.run(app, debug=True, host='127.0.0.1', port=5000)
+    socketio.run(app, debug=True, host=SERVER_HOST, port=SERVER_PORT)
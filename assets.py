@@ -0,0 +1,120 @@
+"""Builds the static assets the kiosk pages load, for serving without a CDN.
+
+    python assets.py           # build static/dist/ from static/ and the committed static/vendor/
+    python assets.py --fetch   # download missing pinned client libraries into static/vendor/ first
+
+Every asset is copied to static/dist/ under a content-hashed name
+(socket.io.min.3f9c2a1b0d4e.js) next to gzip and, if the brotli module is
+installed, brotli variants that are written only when they are smaller.
+static/dist/manifest.json maps the plain name to the hashed file, its hash
+and the available encodings; app.py serves them from memory at /assets/
+with strong ETags and a one-year immutable Cache-Control (a changed file
+gets a new name, so nothing stale is ever served).
+
+static/vendor/ is committed, so kiosks work without internet; static/dist/
+is a build output. Until it is built, app.py serves static/vendor/ as is
+(no hashing or compression), and only falls back to the CDN URLs below for
+a vendor file that is missing. socket.io.min.js (v4.7.5) and tailwind.js
+(the Tailwind Play CDN build, v3.4.5) were taken unmodified from the
+nicegui 2.24.0 wheel on PyPI, which bundles these releases; after changing
+a pin here, run --refetch and commit the new files.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+import urllib.request
+
+try:
+    import brotli # Optional: pip install brotli
+except ImportError:
+    brotli = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(HERE, "static")
+VENDOR_DIR = os.path.join(STATIC_DIR, "vendor")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST_FILE = os.path.join(DIST_DIR, "manifest.json")
+
+# Client libraries, pinned: name in static/vendor/ -> where --fetch gets it (also the CDN fallback)
+VENDOR = {
+    "socket.io.min.js": "https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.7.5/socket.io.min.js",
+    "tailwind.js": "https://cdn.tailwindcss.com/3.4.5",
+}
+# Our own files in static/
+LOCAL = ["favicon.ico"]
+
+HASH_LENGTH = 12 # Hex digits of the SHA-256 in file names and ETags
+
+
+def fetch_vendor(force=False):
+    os.makedirs(VENDOR_DIR, exist_ok=True)
+    for name, url in VENDOR.items():
+        path = os.path.join(VENDOR_DIR, name)
+        if os.path.exists(path) and not force:
+            continue
+        print(f"Fetching {url}")
+        with urllib.request.urlopen(url, timeout=30) as response:
+            data = response.read()
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+def hashed_name(name, digest):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{digest}{ext}"
+
+
+def build():
+    """Writes static/dist/ and its manifest. Returns the manifest."""
+    os.makedirs(DIST_DIR, exist_ok=True)
+    sources = [(name, os.path.join(STATIC_DIR, name)) for name in LOCAL]
+    sources += [(name, os.path.join(VENDOR_DIR, name)) for name in VENDOR]
+    manifest = {}
+    for name, path in sources:
+        if not os.path.exists(path):
+            print(f"Skipping {name}: {os.path.relpath(path, HERE)} is missing (run with --fetch for vendor files)")
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        file_name = hashed_name(name, digest)
+        variants = {"": data, ".gz": gzip.compress(data, compresslevel=9, mtime=0)} # mtime=0: same bytes every build
+        if brotli is not None:
+            variants[".br"] = brotli.compress(data, quality=11)
+        encodings = []
+        for suffix, content in variants.items():
+            if suffix and len(content) >= len(data):
+                continue # Already compressed (e.g. images): the plain file is smaller
+            with open(os.path.join(DIST_DIR, file_name + suffix), "wb") as f:
+                f.write(content)
+            if suffix:
+                encodings.append({".gz": "gzip", ".br": "br"}[suffix])
+        manifest[name] = {"file": file_name, "hash": digest, "encodings": encodings}
+        print(f"{name} -> {file_name} ({len(data)} bytes{', ' if encodings else ''}{', '.join(encodings)})")
+    with open(MANIFEST_FILE, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build hashed, precompressed static assets for app.py")
+    parser.add_argument("--fetch", action="store_true", help="download missing vendor files first")
+    parser.add_argument("--refetch", action="store_true", help="download all vendor files again")
+    args = parser.parse_args(argv)
+    if args.fetch or args.refetch:
+        try:
+            fetch_vendor(force=args.refetch)
+        except OSError as e:
+            print(f"Fetching vendor files failed: {e}", file=sys.stderr)
+            return 1
+    build()
+    if brotli is None:
+        print("brotli is not installed: only gzip variants were written (pip install brotli)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+"""Lunch-rush load test for the canteen server, no NFC hardware needed.
+
+Starts app.py's server against a throwaway database seeded with synthetic
+users, attaches Socket.IO listeners (kiosk displays) to every lane, and taps
+cards on fake readers (fake_reader.py) through the real scanner pipeline
+(card monitor -> lane worker -> HTTP). Registrations are posted alongside.
+
+Reported per run: tap throughput, lost taps, and p50/p95/p99 of
+tap-to-emit latency (card on reader -> scan_result at a display), of the
+scanner's /api/scan round trip and of /api/register.
+
+    python bench.py --users 10000 --rate 20 --duration 30 --lanes 2 --listeners 3
+    python bench.py --url http://127.0.0.1:5000 ...   # against an already running server
+
+Use the same arguments (and --seed) to get comparable baselines; --json
+writes the report to a file.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+import requests
+import socketio
+
+import fake_reader
+import scanner
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Launches the Flask-SocketIO server without the scanner subprocess (the bench drives its own)
+SERVER_LAUNCHER = """
+import sys
+from werkzeug.serving import WSGIRequestHandler
+WSGIRequestHandler.protocol_version = "HTTP/1.1"
+import app
+app.socketio.run(app.app, host="127.0.0.1", port=int(sys.argv[1]), allow_unsafe_werkzeug=True, log_output=False)
+"""
+
+FINAL_STATUSES = {"authorized", "expired", "already_served", "new", "error"} # scan_result statuses that end a tap
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list (None if empty)."""
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[k]
+
+
+def summarize(samples_s):
+    values = sorted(v * 1000 for v in samples_s)
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50),
+        "p95_ms": percentile(values, 95),
+        "p99_ms": percentile(values, 99),
+        "max_ms": values[-1] if values else None,
+    }
+
+
+def make_uid(n, prefix=0x0B):
+    """4-byte UID in the scanner's "0B 00 27 10" format."""
+    return " ".join(f"{b:02X}" for b in bytes([prefix]) + n.to_bytes(3, "big"))
+
+
+# --- Setup ---
+
+def start_server(db_path, port, workdir):
+    env = dict(os.environ, KANTINE_DB=db_path, PYTHONPATH=HERE + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    log = open(os.path.join(workdir, "server.log"), "w")
+    process = subprocess.Popen([sys.executable, "-c", SERVER_LAUNCHER, str(port)],
+                               cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited during startup, see {log.name}")
+        try:
+            requests.get(url + "/api/scanner/status", timeout=1)
+            return process, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Server did not start within 20 s")
+
+
+def seed_users(db_path, count, expired_share, rng):
+    """Fills users with `count` synthetic students; returns (valid UIDs, expired UIDs)."""
+    today = date.today()
+    valid, expired = [], []
+    rows = []
+    for n in range(count):
+        uid = make_uid(n)
+        if rng.random() < expired_share:
+            expired.append(uid)
+            valid_until = today - timedelta(days=rng.randint(1, 200))
+        else:
+            valid.append(uid)
+            valid_until = today + timedelta(days=rng.randint(1, 200))
+        rows.append((uid, f"Elev {n}", valid_until.isoformat()))
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO users (nfc_id, name, subscription_valid_until) VALUES (?, ?, ?)", rows)
+    conn.close()
+    return valid, expired
+
+
+# --- Load generation ---
+
+class Recorder:
+    """Collects timestamps from the tap generators, the scanner and the listeners."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {} # (lane, uid) -> perf_counter at card insert
+        self.tap_to_emit = []
+        self.scan_http = []
+        self.register_http = []
+        self.taps = 0
+        self.emits = 0
+        self.errors = 0
+
+    def tapped(self, lane, uid):
+        with self.lock:
+            self.pending[(lane, uid)] = time.perf_counter()
+            self.taps += 1
+
+    def received(self, data):
+        now = time.perf_counter()
+        with self.lock:
+            self.emits += 1
+            if data.get("status") not in FINAL_STATUSES:
+                return
+            started = self.pending.get((data.get("lane"), data.get("uid")))
+            if started is not None:
+                self.tap_to_emit.append(now - started)
+
+
+def attach_listeners(url, lanes, per_lane, recorder):
+    clients = []
+    for lane in lanes:
+        for _ in range(per_lane):
+            client = socketio.Client(reconnection=False)
+            client.on("scan_result", recorder.received)
+            client.connect(f"{url}?lane={lane}", wait_timeout=10)
+            clients.append(client)
+    return clients
+
+
+def instrument_scanner(recorder):
+    """Wraps scanner.send_scan to time the scanner -> /api/scan round trip."""
+    send_scan = scanner.send_scan
+
+    def timed_send_scan(uid, lane=None, trace=None):
+        started = time.perf_counter()
+        send_scan(uid, lane, trace)
+        with recorder.lock:
+            recorder.scan_http.append(time.perf_counter() - started)
+
+    scanner.send_scan = timed_send_scan
+
+
+def tap_lane(reader, lane, rate, hold_s, uids, stop, recorder, rng):
+    """Taps cards on one fake reader at a fixed rate (open loop) until `stop` is set."""
+    interval = 1 / rate
+    next_tap = time.monotonic()
+    while not stop.is_set():
+        uid = rng.choice(uids)
+        recorder.tapped(lane, uid)
+        fake_reader.insert(uid, reader)
+        time.sleep(hold_s) # The card stays on the reader for a moment, like a real tap
+        fake_reader.remove(reader)
+        next_tap += interval
+        delay = next_tap - time.monotonic()
+        if delay > 0:
+            stop.wait(delay)
+        else:
+            next_tap = time.monotonic() # Falling behind: don't burst to catch up
+
+
+def register_loop(url, rate, lanes, stop, recorder, session):
+    interval = 1 / rate
+    n = 0
+    while not stop.wait(interval):
+        uid = make_uid(n, prefix=0xFE)
+        n += 1
+        started = time.perf_counter()
+        try:
+            response = session.post(url + "/api/register",
+                                    json={"uid": uid, "name": f"Ny elev {n}", "lane": lanes[n % len(lanes)]},
+                                    timeout=5)
+            if response.status_code != 200:
+                recorder.errors += 1
+        except requests.RequestException:
+            recorder.errors += 1
+            continue
+        with recorder.lock:
+            recorder.register_http.append(time.perf_counter() - started)
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="kantine-bench-")
+    server = None
+    url = args.url
+    if url is None:
+        db_path = os.path.join(workdir, "bench.db")
+        server, url = start_server(db_path, args.port, workdir)
+        valid, expired = seed_users(db_path, args.users, args.expired_share, rng)
+        requests.post(url + "/api/cache/reload", timeout=30) # Pick up the seeded users
+    else:
+        valid, expired = [make_uid(n) for n in range(args.users)], []
+    unknown = [make_uid(n, prefix=0xFD) for n in range(max(1, args.users // 20))]
+    # Tap mix: mostly registered students, some expired cards, a few new cards
+    uids = valid + expired + unknown[:len(unknown) // 2]
+
+    recorder = Recorder()
+    scanner.SERVER_URL = url # Scans, removals and everything else the scanner sends go to the bench server
+    instrument_scanner(recorder)
+
+    lanes = [str(i + 1) for i in range(args.lanes)]
+    readers = [fake_reader.add_reader(f"Bench Reader {lane}") for lane in lanes]
+    lane_map = scanner.LaneMap({str(reader): lane for reader, lane in zip(readers, lanes)})
+    monitor = fake_reader.CardMonitor()
+    monitor.addObserver(scanner.ScanObserver(scanner.LaneDispatcher(lane_map)))
+
+    clients = attach_listeners(url, lanes, args.listeners, recorder)
+    stop = threading.Event()
+    threads = [threading.Thread(target=tap_lane,
+                                args=(reader, lane, args.rate / args.lanes, args.hold_ms / 1000, uids, stop,
+                                      recorder, random.Random(rng.random())),
+                                daemon=True)
+               for reader, lane in zip(readers, lanes)]
+    if args.register_rate > 0:
+        threads.append(threading.Thread(target=register_loop,
+                                        args=(url, args.register_rate, lanes, stop, recorder, requests.Session()),
+                                        daemon=True))
+
+    print(f"Running {args.duration}s: {args.rate} taps/s over {args.lanes} lane(s), "
+          f"{args.listeners} display(s) per lane, {args.register_rate} registrations/s against {url}")
+    # The scanner prints several lines per tap; keep them out of the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        time.sleep(1) # Let in-flight taps reach the displays
+
+    for client in clients:
+        client.disconnect()
+    if server is not None:
+        server.terminate()
+        server.wait()
+
+    with recorder.lock:
+        answered = len(recorder.tap_to_emit) // max(1, args.listeners)
+        report = {
+            "config": vars(args),
+            "taps": recorder.taps,
+            "taps_answered": answered,
+            "taps_lost": recorder.taps - answered,
+            "throughput_taps_per_s": round(answered / elapsed, 2),
+            "emits_received": recorder.emits,
+            "register_errors": recorder.errors,
+            "tap_to_emit": summarize(recorder.tap_to_emit),
+            "scan_http": summarize(recorder.scan_http),
+            "register_http": summarize(recorder.register_http),
+        }
+    return report
+
+
+def print_report(report):
+    print(f"Taps: {report['taps']} sent, {report['taps_answered']} answered, {report['taps_lost']} lost "
+          f"({report['throughput_taps_per_s']} taps/s); {report['emits_received']} events received")
+    for key, label in (("tap_to_emit", "Tap -> display"), ("scan_http", "/api/scan"), ("register_http", "/api/register")):
+        s = report[key]
+        if s["count"]:
+            print(f"{label:>15}: n={s['count']:<6} p50={s['p50_ms']:.1f} ms  p95={s['p95_ms']:.1f} ms  "
+                  f"p99={s['p99_ms']:.1f} ms  max={s['max_ms']:.1f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test for the canteen server with simulated NFC readers")
+    parser.add_argument("--url", help="test an already running server instead of starting one (no seeding)")
+    parser.add_argument("--port", type=int, default=5055, help="port for the server the bench starts")
+    parser.add_argument("--users", type=int, default=10000, help="synthetic users to seed")
+    parser.add_argument("--expired-share", type=float, default=0.1, help="share of seeded users with an expired card")
+    parser.add_argument("--rate", type=float, default=10, help="taps per second, over all lanes")
+    parser.add_argument("--register-rate", type=float, default=0.5, help="registrations per second (0 = none)")
+    parser.add_argument("--duration", type=float, default=20, help="seconds to run")
+    parser.add_argument("--lanes", type=int, default=2, help="fake readers, one lane each")
+    parser.add_argument("--listeners", type=int, default=2, help="Socket.IO displays per lane")
+    parser.add_argument("--hold-ms", type=float, default=100, help="how long each card stays on the reader")
+    parser.add_argument("--seed", type=int, default=1, help="random seed, for repeatable runs")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
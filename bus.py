@@ -0,0 +1,100 @@
+"""Cross-process event bus for running several server workers.
+
+With `python app.py serve N` there are N server processes, each with its
+own Socket.IO clients and its own in-memory caches. Whatever one worker
+does that the others need to know (a scan result for the displays, a user
+or menu that changed) is published here and delivered to the other workers.
+
+The bus is a table in a shared SQLite file (no broker to install):
+publish() appends a row, and a thread in every worker polls for rows from
+other processes. Row IDs only ever go up, so they double as a global order
+of events. With a single worker the bus is disabled and publish() returns
+None without touching the disk.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+BUS_FILE = os.environ.get("KANTINE_BUS_DB", "kantine_bus.db")
+POLL_INTERVAL = 0.02 # Seconds between polls for new events
+RETENTION = 60 # Seconds an event stays in the table (late readers have long caught up by then)
+PRUNE_INTERVAL = 10 # Seconds between deletes of old events
+
+
+class EventBus:
+    def __init__(self, path=BUS_FILE, enabled=False):
+        self.path = path
+        self.enabled = enabled
+        self.origin = os.getpid()
+        self.handlers = {} # kind -> [handler(event_id, data)]
+        self.lock = threading.Lock() # Guards the publishing connection
+        self.conn = None
+        self.thread = None
+        self.delivered = 0 # Events from other workers handed to handlers
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL") # Losing the last events in a power cut is fine
+        return conn
+
+    def subscribe(self, kind, handler):
+        """Calls handler(event_id, data) for every `kind` event published by another worker."""
+        self.handlers.setdefault(kind, []).append(handler)
+
+    def publish(self, kind, data):
+        """Sends an event to the other workers. Returns its ID (a global sequence number), or None if disabled."""
+        if not self.enabled:
+            return None
+        with self.lock:
+            cursor = self.conn.execute("INSERT INTO events (origin, kind, data, created) VALUES (?, ?, ?, ?)",
+                                       (self.origin, kind, json.dumps(data), time.time()))
+            return cursor.lastrowid
+
+    def start(self, listen=True):
+        """Opens the bus. With listen=False (a process that only publishes) no events are delivered to it."""
+        if not self.enabled or self.thread is not None or self.conn is not None:
+            return
+        self.conn = self._connect()
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                origin INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                data TEXT NOT NULL,
+                created REAL NOT NULL
+            )
+        """)
+        if not listen:
+            return
+        # Only events published from now on are delivered
+        last_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+        self.thread = threading.Thread(target=self.run, args=(last_id,), name="event-bus", daemon=True)
+        self.thread.start()
+
+    def run(self, last_id):
+        conn = self._connect()
+        last_prune = time.monotonic()
+        while True:
+            try:
+                rows = conn.execute("SELECT id, origin, kind, data FROM events WHERE id > ? ORDER BY id",
+                                    (last_id,)).fetchall()
+                if time.monotonic() - last_prune > PRUNE_INTERVAL:
+                    conn.execute("DELETE FROM events WHERE created < ?", (time.time() - RETENTION,))
+                    last_prune = time.monotonic()
+            except sqlite3.Error as e:
+                print(f"Event bus error: {e}")
+                rows = []
+            for event_id, origin, kind, data in rows:
+                last_id = event_id
+                if origin == self.origin:
+                    continue # Our own event, already handled locally
+                for handler in self.handlers.get(kind, ()):
+                    try:
+                        handler(event_id, json.loads(data))
+                    except Exception as e:
+                        print(f"Error handling {kind} event {event_id}: {e}")
+                self.delivered += 1
+            time.sleep(POLL_INTERVAL)
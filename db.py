@@ -0,0 +1,131 @@
+"""Shared SQLite access layer for the canteen app.
+
+All database access goes through this module instead of opening a fresh
+sqlite3 connection per call. Connections are kept in a small pool, run in
+WAL mode (so scans can read while a registration is writing) and keep their
+compiled statement cache between requests.
+"""
+import os
+import sqlite3
+import threading
+import queue
+import time
+from contextlib import contextmanager
+from metrics import Histogram
+
+DB_FILE = os.environ.get("KANTINE_DB", "Kantinens_kunder.db") # KANTINE_DB: use another database file (e.g. for benchmarks)
+
+POOL_SIZE = 8 # Idle connections kept open; extra connections are closed after use
+BUSY_TIMEOUT_MS = 5000 # How long a writer waits for the write lock before failing
+CACHED_STATEMENTS = 256 # Prepared statements kept compiled per connection
+
+DB_SECONDS = Histogram("kantine_db_seconds", "Time spent in database calls", ["operation"])
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_local = threading.local() # Connection currently borrowed by this thread (makes nesting reuse it)
+
+
+def _connect():
+    """Opens a new connection with the pragmas we want on every connection."""
+    # isolation_level=None: autocommit, so plain reads never hold a transaction open.
+    # Writes get an explicit BEGIN IMMEDIATE from transaction() below.
+    conn = sqlite3.connect(DB_FILE,
+                           timeout=BUSY_TIMEOUT_MS / 1000,
+                           isolation_level=None,
+                           check_same_thread=False, # Connections move between request threads via the pool
+                           cached_statements=CACHED_STATEMENTS)
+    conn.execute("PRAGMA journal_mode=WAL") # Readers don't block behind a writer
+    conn.execute("PRAGMA synchronous=NORMAL") # Safe with WAL, avoids an fsync per commit
+    conn.execute("PRAGMA cache_size=-8000") # ~8 MB page cache per connection
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+
+@contextmanager
+def connection():
+    """Borrows a pooled connection for the duration of the with-block.
+
+    Re-entrant: if this thread already holds a connection (e.g. inside
+    transaction()), the same connection is handed out again.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        yield conn
+        return
+
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = _connect()
+    _local.conn = conn
+    try:
+        yield conn
+    finally:
+        _local.conn = None
+        if conn.in_transaction:
+            # Never hand a connection with a half-finished transaction back to the pool
+            conn.rollback()
+        try:
+            _pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+@contextmanager
+def transaction(busy_timeout_ms=None):
+    """Runs the with-block as one write transaction (BEGIN IMMEDIATE ... COMMIT).
+
+    Rolls back and re-raises on any exception. Nested calls join the outer
+    transaction instead of starting a new one. `busy_timeout_ms` shortens the
+    wait for the write lock, for callers that must answer quickly (it then
+    fails with "database is locked").
+    """
+    with connection() as conn:
+        if conn.in_transaction:
+            yield conn
+            return
+        started = time.perf_counter()
+        if busy_timeout_ms is not None:
+            conn.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+        finally:
+            if busy_timeout_ms is not None:
+                conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            DB_SECONDS.labels("transaction").observe(time.perf_counter() - started)
+
+
+def query_one(sql, params=()):
+    """Runs a read query and returns the first row (or None)."""
+    started = time.perf_counter()
+    with connection() as conn:
+        row = conn.execute(sql, params).fetchone()
+    DB_SECONDS.labels("query_one").observe(time.perf_counter() - started)
+    return row
+
+
+def query_all(sql, params=()):
+    """Runs a read query and returns all rows as a list."""
+    started = time.perf_counter()
+    with connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    DB_SECONDS.labels("query_all").observe(time.perf_counter() - started)
+    return rows
+
+
+def close_all():
+    """Closes every idle pooled connection (used at shutdown and in tools that switch DB_FILE)."""
+    while True:
+        try:
+            conn = _pool.get_nowait()
+        except queue.Empty:
+            break
+        conn.close()
@@ -0,0 +1,133 @@
+"""Fake pyscard backend for running scanner.py without NFC hardware.
+
+Mimics the small part of pyscard that scanner.py uses: readers(), cards
+with createConnection()/connect()/transmit(), and a CardMonitor that calls
+observer.update(observable, (added_cards, removed_cards)). Cards are
+"tapped" from code (tests, benchmarks) with insert() and remove().
+"""
+import threading
+
+
+class FakeConnection:
+    """Answers the GET UID APDU (FF CA 00 00 00) with the card's UID, and records LED/buzzer commands (FF 00 40 ...)."""
+
+    def __init__(self, card):
+        self.card = card
+
+    def connect(self):
+        if not self.card.present:
+            raise Exception("Card is not present") # Same situation pyscard reports as NoCardException
+
+    def transmit(self, command):
+        if command == [0xFF, 0xCA, 0x00, 0x00, 0x00]:
+            return list(self.card.uid_bytes), 0x90, 0x00
+        if command[:3] == [0xFF, 0x00, 0x40]:
+            self.card.reader.signals.append(list(command))
+            return [], 0x90, 0x00
+        return [], 0x6A, 0x81 # Function not supported
+
+    def disconnect(self):
+        pass
+
+
+class FakeCard:
+    def __init__(self, reader, uid):
+        self.reader = reader
+        self.uid_bytes = bytes.fromhex(uid.replace(" ", ""))
+        self.atr = [0x3B, 0x80, 0x80, 0x01, 0x01]
+        self.present = True
+
+    def createConnection(self):
+        return FakeConnection(self)
+
+    def __repr__(self):
+        return f"FakeCard({self.reader}, {self.uid_bytes.hex().upper()})"
+
+
+class FakeReader:
+    def __init__(self, name):
+        self.name = name
+        self.card = None # Card currently on the reader
+        self.signals = [] # LED/buzzer commands sent to the reader, oldest first
+
+    def createConnection(self):
+        if self.card is None:
+            raise Exception("No card on reader")
+        return self.card.createConnection()
+
+    def __str__(self):
+        return self.name
+
+
+# Readers returned by readers(); tests and benchmarks can add more
+_readers = [FakeReader("Fake NFC Reader 0")]
+_monitors = []
+_lock = threading.Lock()
+
+
+def readers():
+    return list(_readers)
+
+
+def add_reader(name):
+    reader = FakeReader(name)
+    with _lock:
+        _readers.append(reader)
+    return reader
+
+
+def insert(uid, reader=None):
+    """Puts a card with the given hex UID on a reader and notifies all monitors."""
+    reader = reader or _readers[0]
+    with _lock:
+        if reader.card is not None:
+            _remove_locked(reader)
+        card = FakeCard(reader, uid)
+        reader.card = card
+        monitors = list(_monitors)
+    for monitor in monitors:
+        monitor.notify([card], [])
+    return card
+
+
+def remove(reader=None):
+    """Takes the card off a reader and notifies all monitors."""
+    reader = reader or _readers[0]
+    with _lock:
+        card = _remove_locked(reader)
+        monitors = list(_monitors)
+    if card is not None:
+        for monitor in monitors:
+            monitor.notify([], [card])
+
+
+def _remove_locked(reader):
+    card = reader.card
+    if card is not None:
+        card.present = False
+        reader.card = None
+    return card
+
+
+class CardMonitor:
+    """Drop-in for smartcard.CardMonitoring.CardMonitor, driven by insert()/remove()."""
+
+    def __init__(self):
+        self.observers = []
+        with _lock:
+            _monitors.append(self)
+
+    def addObserver(self, observer):
+        self.observers.append(observer)
+        # Like pyscard, a new observer is told about cards already present
+        present = [r.card for r in _readers if r.card is not None]
+        if present:
+            observer.update(self, (present, []))
+
+    def deleteObserver(self, observer):
+        if observer in self.observers:
+            self.observers.remove(observer)
+
+    def notify(self, added, removed):
+        for observer in list(self.observers):
+            observer.update(self, (added, removed))
@@ -0,0 +1,197 @@
+"""Minimal Prometheus-style metrics for the canteen app (no extra dependencies).
+
+Counters, gauges and histograms with labels, rendered in the Prometheus text
+exposition format by render(). Recording a value is a dict lookup plus a
+short locked update, so it is cheap enough for the tap path.
+
+    SCANS = Histogram("scan_seconds", "Time to handle a scan", ["outcome"])
+    SCANS.labels("authorized").observe(0.004)
+
+Several processes (app.py's workers) each collect() their samples with a
+label of their own ({"worker": "0"}), and render() merges the collections
+into one exposition with each metric's HELP/TYPE written once.
+"""
+import threading
+from bisect import bisect_left
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; fine-grained at the low end where a cached tap decision lands
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+_metrics = [] # Every metric created, in creation order, for render()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, *extra):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(e for e in extra if e)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self.labels() # Unlabelled metrics are rendered (as 0) from the start
+        _metrics.append(self)
+
+    def labels(self, *values):
+        """Returns the child for these label values (created on first use)."""
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _default(self):
+        # Metrics without labels are used directly: COUNTER.inc()
+        return self.labels()
+
+    def samples(self, const=""):
+        """The sample lines; `const` is a formatted label list (worker="0") added to each."""
+        lines = []
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child, const))
+        return lines
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_name}"] + self.samples()
+
+
+class _Value:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    """A value that only goes up. With `function`, the value is read from it at render time instead."""
+    type_name = "counter"
+
+    def __init__(self, name, help_text, labelnames=(), function=None):
+        super().__init__(name, help_text, labelnames)
+        self.function = function
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def samples(self, const=""):
+        if self.function is not None:
+            self._default().set(self.function())
+        return super().samples(const)
+
+    def _render_child(self, values, child, const=""):
+        return [f"{self.name}{_format_labels(self.labelnames, values, const)} {_format_value(child.value)}"]
+
+
+class Gauge(Counter):
+    """A value that goes up and down."""
+    type_name = "gauge"
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def set(self, value):
+        self._default().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # Last slot is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def _render_child(self, values, child, const=""):
+        with child.lock:
+            counts = list(child.counts)
+            total = child.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = f'le="{_format_value(float(bound))}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, const, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, values, const)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def collect(const_labels=None):
+    """This process's metrics as [name, help, type, sample lines] lists (JSON-safe), with `const_labels` on every sample."""
+    const = ",".join(f'{n}="{_escape(v)}"' for n, v in (const_labels or {}).items())
+    return [[m.name, m.help, m.type_name, m.samples(const)] for m in _metrics]
+
+
+def render(collections=None):
+    """All metrics in Prometheus text format: this process's, or the merged samples of several collect() results."""
+    if collections is None:
+        collections = [collect()]
+    families = {} # name -> (help, type, sample lines), in order of first appearance
+    for collection in collections:
+        for name, help_text, type_name, samples in collection:
+            families.setdefault(name, (help_text, type_name, []))[2].extend(samples)
+    lines = []
+    for name, (help_text, type_name, samples) in families.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {type_name}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
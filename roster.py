@@ -0,0 +1,159 @@
+"""Roster import/export from the command line.
+
+    python app.py import roster.csv   -> create/update users from a CSV file
+    python app.py export [roster.csv] -> write all users as CSV (stdout if no file)
+
+CSV columns: nfc_id, name, subscription_valid_until (YYYY-MM-DD, optional).
+
+app.py hands these commands to main() before it starts anything of the
+server (schema migrations, caches, background threads), so an export to
+stdout is only the CSV. Only the database is touched; the database must
+exist, so start the server once on a fresh install. A running server is
+asked to reload its authorization cache after an import.
+"""
+import csv
+import sqlite3
+import sys
+import urllib.request
+from datetime import datetime, timedelta
+
+import db
+
+ROSTER_COLUMNS = ["nfc_id", "name", "subscription_valid_until"]
+ROSTER_BATCH_SIZE = 500 # Rows per executemany
+
+
+def parse_date(value):
+    """A 'YYYY-MM-DD' date string as a date, or None if it isn't one (same rule as app.parse_valid_until)."""
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def check_database(conn):
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'").fetchone() is None:
+        raise ValueError(f"{db.DB_FILE} has no users table; start the server once to create the database")
+
+
+def import_roster(path, term_days):
+    """
+    Streams a roster CSV into users in one transaction. Existing UIDs are updated
+    (upsert); an empty expiry keeps the current one, or gives new users `term_days` days.
+    Returns a summary dict; rejected rows and conflicts are printed.
+    """
+    default_valid_until = (datetime.now() + timedelta(days=term_days)).strftime("%Y-%m-%d")
+    summary = {"inserted": 0, "updated": 0, "rejected": 0, "duplicates": 0}
+    seen = set() # UIDs already imported from this file, to report duplicates
+
+    def flush(conn, batch):
+        # Look the batch's UIDs up first so inserts and updates can be told apart in the report
+        uids = [row["nfc_id"] for row in batch]
+        placeholders = ",".join("?" * len(uids))
+        existing = {uid for (uid,) in conn.execute(f"SELECT nfc_id FROM users WHERE nfc_id IN ({placeholders})", uids)}
+        conn.executemany("""
+            INSERT INTO users (nfc_id, name, subscription_valid_until)
+            VALUES (:nfc_id, :name, COALESCE(:valid_until, :default_valid_until))
+            ON CONFLICT(nfc_id) DO UPDATE SET
+                name = excluded.name,
+                subscription_valid_until = COALESCE(:valid_until, users.subscription_valid_until)
+        """, batch)
+        for row in batch:
+            if row["nfc_id"] in existing:
+                summary["updated"] += 1
+                print(f"Conflict: line {row['line']}: UID {row['nfc_id']} already registered, updated.")
+            else:
+                summary["inserted"] += 1
+
+    with open(path, newline="", encoding="utf-8-sig") as f, db.transaction() as conn:
+        check_database(conn)
+        reader = csv.DictReader(f)
+        missing = [c for c in ("nfc_id", "name") if c not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"Roster is missing column(s): {', '.join(missing)}")
+
+        batch = []
+        for row in reader:
+            line = reader.line_num
+            nfc_id = (row.get("nfc_id") or "").strip()
+            name = (row.get("name") or "").strip()
+            valid_until = (row.get("subscription_valid_until") or "").strip() or None
+            if not nfc_id or not name:
+                summary["rejected"] += 1
+                print(f"Rejected: line {line}: missing nfc_id or name.")
+                continue
+            if valid_until:
+                if parse_date(valid_until) is None:
+                    summary["rejected"] += 1
+                    print(f"Rejected: line {line}: invalid date {valid_until!r} for UID {nfc_id}.")
+                    continue
+                valid_until = parse_date(valid_until).isoformat() # Stored zero-padded, e.g. 2026-11-1 -> 2026-11-01
+            if nfc_id in seen:
+                # Same UID twice in the file: the later line wins
+                summary["duplicates"] += 1
+                print(f"Conflict: line {line}: UID {nfc_id} appears earlier in the file, later line wins.")
+                flush(conn, batch) # Earlier row must be written before this one overrides it
+                batch = []
+            seen.add(nfc_id)
+            batch.append({"line": line, "nfc_id": nfc_id, "name": name, "valid_until": valid_until,
+                          "default_valid_until": default_valid_until})
+            if len(batch) >= ROSTER_BATCH_SIZE:
+                flush(conn, batch)
+                batch = []
+        if batch:
+            flush(conn, batch)
+    return summary
+
+
+def notify_server_cache_reload(url):
+    """Asks a running server (POST to its /api/cache/reload) to drop the entries it has cached."""
+    try:
+        req = urllib.request.Request(url, data=b"", method="POST")
+        urllib.request.urlopen(req, timeout=2).close()
+        print("Running server reloaded its authorization cache.")
+    except OSError:
+        print("No running server reached; it will load the new roster when it starts.")
+
+
+def export_roster(path=None):
+    """Writes all users as CSV, row by row from the cursor (the table is never loaded into memory)."""
+    with db.connection() as conn:
+        check_database(conn)
+        f = open(path, "w", newline="", encoding="utf-8") if path else sys.stdout
+        count = 0
+        try:
+            writer = csv.writer(f)
+            writer.writerow(ROSTER_COLUMNS)
+            for row in conn.execute("SELECT nfc_id, name, subscription_valid_until FROM users ORDER BY id"):
+                writer.writerow(row)
+                count += 1
+        finally:
+            if path:
+                f.close()
+    return count
+
+
+def main(args, term_days, reload_url):
+    """Runs `import <file>` or `export [file]`. Returns the process exit code."""
+    command = args[0] if args else None
+    if command == "import" and len(args) == 2:
+        try:
+            summary = import_roster(args[1], term_days)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"Import failed, nothing was changed: {e}", file=sys.stderr)
+            return 1
+        notify_server_cache_reload(reload_url)
+        print(f"Import done: {summary['inserted']} inserted, {summary['updated']} updated, "
+              f"{summary['rejected']} rejected, {summary['duplicates']} duplicate UIDs in file.")
+        return 0
+    if command == "export" and len(args) <= 2:
+        path = args[1] if len(args) == 2 else None
+        try:
+            count = export_roster(path)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"Export failed: {e}", file=sys.stderr)
+            return 1
+        print(f"Exported {count} users.", file=sys.stderr if path is None else sys.stdout)
+        return 0
+    print("Usage: python app.py import <roster.csv> | python app.py export [roster.csv]", file=sys.stderr)
+    return 2
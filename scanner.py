@@ -1,12 +1,60 @@
+import os
 import time
+import argparse
+import threading
+import queue
+import sqlite3
+import json
+import uuid
+from datetime import datetime, date
 import requests
+from requests.adapters import HTTPAdapter
 # Removed webbrowser as we don't want to open new windows
 # import webbrowser
-from smartcard.System import readers
-from smartcard.util import toHexString
+
+SERVER_URL = "http://127.0.0.1:5000" # Every endpoint below is joined to this when called (bench.py points it elsewhere)
+SCAN_PATH = "/api/scan"
+BULK_SCAN_PATH = "/api/scan/bulk"
+REMOVE_PATH = "/api/remove"
+USER_CHANGES_PATH = "/api/users/changes"
+REQUEST_TIMEOUT = 2 # Seconds before a tap is given up on and buffered instead
+
+# Taps that couldn't be delivered are kept here until the server is back
+QUEUE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scanner_queue.db")
+REPLAY_INTERVAL = 2 # Seconds between attempts to flush the offline queue
+REPLAY_BATCH_SIZE = 100 # Taps per /api/scan/bulk request
+
+# Local copy of which UIDs are valid until when, for deciding taps while the server is down
+SNAPSHOT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scanner_snapshot.json")
+SNAPSHOT_SYNC_INTERVAL = 30 # Seconds between delta syncs with the server
+MEALS_PER_DAY = int(os.environ.get("KANTINE_MEALS_PER_DAY", 1)) # Same setting as app.py; 0 = no limit
+
+# app.py's supervisor restarts the scanner if this line stops appearing on stdout
+HEARTBEAT_LINE = "@@heartbeat"
+HEARTBEAT_INTERVAL = 5 # Seconds
+
+# One keep-alive session for all lanes, so taps reuse an open connection to app.py
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=8))
+
+
+def load_backend(fake=False):
+    """Returns (readers, CardMonitor) from pyscard, or from fake_reader when running without hardware."""
+    if fake:
+        import fake_reader
+        return fake_reader.readers, fake_reader.CardMonitor
+    from smartcard.System import readers
+    from smartcard.CardMonitoring import CardMonitor
+    return readers, CardMonitor
+
+
+def to_hex_string(data):
+    # Same format as smartcard.util.toHexString: "04 A2 3B 1C"
+    return " ".join(f"{b:02X}" for b in data)
 
 
 def get_uid(reader):
+    # Works for both a reader (poll mode) and a card from the card monitor (event mode)
     try:
         connection = reader.createConnection()
         connection.connect()
@@ -17,7 +65,7 @@ def get_uid(reader):
         print(f"Response received - SW1: {sw1}, SW2: {sw2}")  # Debug line
 
         if sw1 == 0x90:
-            return toHexString(response)
+            return to_hex_string(response)
         else:
             print(f"Error response from reader: SW1={sw1:02x}, SW2={sw2:02x}")
             return None
@@ -26,9 +74,406 @@ def get_uid(reader):
         return None
 
 
-def main():
-    print("📡 NFC Scanner started.")
-    last_uid = None
+# ACR122U "bi-color LED and buzzer control" pseudo-APDU: FF 00 40 <LED state> 04 <T1> <T2> <repeats> <buzzer>,
+# T1/T2 in 100 ms. Green blinks once with one beep = serve; red blinks three times with beeps = don't serve.
+VERDICT_SIGNALS = {
+    True: [0xFF, 0x00, 0x40, 0xA8, 0x04, 0x05, 0x01, 0x01, 0x01],
+    False: [0xFF, 0x00, 0x40, 0x54, 0x04, 0x02, 0x02, 0x03, 0x03],
+}
+
+
+def signal_verdict(reader, authorized):
+    """Shows a decision on the reader itself (LED and buzzer). Readers without the command just ignore it."""
+    try:
+        connection = reader.createConnection()
+        connection.connect()
+        connection.transmit(VERDICT_SIGNALS[authorized])
+    except Exception as e:
+        print(f"Kunne ikke vise afgørelsen på læseren: {e}")
+
+
+# --- Offline Queue ---
+
+class TapQueue:
+    """Durable FIFO of undelivered taps, stored in a small SQLite file next to the scanner."""
+
+    def __init__(self, path=QUEUE_FILE):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS pending_scans (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                uid TEXT NOT NULL,
+                lane TEXT,
+                scanned_at TEXT NOT NULL,
+                offline_decision TEXT,
+                tap_id TEXT
+            )
+        """)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(pending_scans)")]
+        for column in ("offline_decision", "tap_id"):
+            if column not in columns: # Queue file from an older scanner
+                self.conn.execute(f"ALTER TABLE pending_scans ADD COLUMN {column} TEXT")
+
+    def put(self, uid, lane, scanned_at, offline_decision=None, tap_id=None):
+        with self.lock:
+            self.conn.execute("""
+                INSERT INTO pending_scans (uid, lane, scanned_at, offline_decision, tap_id) VALUES (?, ?, ?, ?, ?)
+            """, (uid, lane, scanned_at, offline_decision, tap_id))
+
+    def peek(self, limit):
+        """Returns up to `limit` of the oldest taps as (id, uid, lane, scanned_at, offline_decision, tap_id) rows."""
+        with self.lock:
+            return self.conn.execute("""
+                SELECT id, uid, lane, scanned_at, offline_decision, tap_id FROM pending_scans ORDER BY id LIMIT ?
+            """, (limit,)).fetchall()
+
+    def delete(self, ids):
+        with self.lock:
+            self.conn.executemany("DELETE FROM pending_scans WHERE id = ?", [(i,) for i in ids])
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM pending_scans").fetchone()[0]
+
+
+tap_queue = None # TapQueue, opened in main()
+
+
+def replay_pending(tap_queue):
+    """Sends buffered taps to the bulk endpoint, oldest first. Returns how many were delivered."""
+    delivered = 0
+    while True:
+        rows = tap_queue.peek(REPLAY_BATCH_SIZE)
+        if not rows:
+            return delivered
+        # tap_id lets the server skip taps it already handled (e.g. a batch sent again after a timeout)
+        scans = [{"uid": uid, "lane": lane, "scanned_at": scanned_at, "offline_decision": decision, "tap_id": tap_id}
+                 for _, uid, lane, scanned_at, decision, tap_id in rows]
+        response = session.post(SERVER_URL + BULK_SCAN_PATH, json={"scans": scans}, timeout=REQUEST_TIMEOUT * 5)
+        response.raise_for_status()
+        tap_queue.delete([row[0] for row in rows])
+        mismatches = response.json().get("mismatches", 0)
+        if mismatches:
+            print(f"⚠️  {mismatches} offline-afgørelser var forkerte ifølge serveren.")
+        delivered += len(rows)
+
+
+def run_replayer(tap_queue):
+    while True:
+        time.sleep(REPLAY_INTERVAL)
+        try:
+            delivered = replay_pending(tap_queue)
+            if delivered:
+                print(f"📤 {delivered} gemte scanninger sendt til serveren.")
+        except requests.RequestException:
+            pass # Server still unreachable, try again next round
+
+
+# --- Offline Authorization ---
+# While the server is unreachable the kiosk screen (served by it) can't show
+# anything, so each tap is decided here and shown on the reader: green blink
+# and one beep = serve, three red blinks and beeps = don't serve (see
+# VERDICT_SIGNALS). The decision is also logged to scanner.log and sent with
+# the tap when it is replayed, so the server can report disagreements.
+
+class AuthSnapshot:
+    """
+    Local UID -> expiry snapshot, kept in sync from the server's delta feed
+    (/api/users/changes) and saved to SNAPSHOT_FILE so it survives restarts.
+    Expiries are stored as date ordinals, so a decision is a dict lookup and
+    an integer compare. It also counts the meals served today per UID (taps
+    the server authorized plus offline ones), so MEALS_PER_DAY holds offline too.
+    """
+
+    def __init__(self, path=SNAPSHOT_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.version = 0
+        self.expiry = {} # uid -> date ordinal of subscription_valid_until, None if the server has no valid date
+        self.served_day = None # Date ordinal the served counts are for
+        self.served = {} # uid -> meals served that day
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.version = data["version"]
+            self.expiry = data["expiry"]
+            self.served_day = data.get("served_day")
+            self.served = data.get("served", {})
+        except (OSError, ValueError, KeyError):
+            pass # No usable snapshot yet; the first sync fetches everything
+
+    def save(self):
+        with self.lock:
+            data = {"version": self.version, "expiry": dict(self.expiry),
+                    "served_day": self.served_day, "served": dict(self.served)}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path) # Atomic, a crash never leaves a half-written snapshot
+
+    def sync(self):
+        """Applies all changes since our version. Returns how many were applied."""
+        applied = 0
+        while True:
+            response = session.get(SERVER_URL + USER_CHANGES_PATH, params={"since": self.version, "limit": 1000},
+                                   timeout=REQUEST_TIMEOUT * 5)
+            response.raise_for_status()
+            data = response.json()
+            with self.lock:
+                for change in data["changes"]:
+                    if change["deleted"]:
+                        self.expiry.pop(change["uid"], None)
+                    else:
+                        valid_until = change["valid_until"]
+                        self.expiry[change["uid"]] = date.fromisoformat(valid_until).toordinal() if valid_until else None
+                self.version = data["version"]
+            applied += len(data["changes"])
+            if not data["more"]:
+                break
+        if applied:
+            self.save()
+        return applied
+
+    def _served_today(self):
+        """The served counts, started over when the day changed (caller holds the lock)."""
+        today = date.today().toordinal()
+        if self.served_day != today:
+            self.served_day = today
+            self.served = {}
+        return self.served
+
+    def record_served(self, uid, count=None):
+        """Notes a meal the server served (or, with `count`, how many the UID has had today)."""
+        with self.lock:
+            served = self._served_today()
+            served[uid] = served.get(uid, 0) + 1 if count is None else count
+
+    def decide(self, uid):
+        """Same outcome names, cutoff and daily meal limit as the server: valid until the start of the expiry day."""
+        if uid not in self.expiry:
+            return "new"
+        expiry = self.expiry[uid]
+        if expiry is None:
+            return "error"
+        if expiry <= date.today().toordinal():
+            return "expired"
+        with self.lock:
+            served = self._served_today()
+            if MEALS_PER_DAY and served.get(uid, 0) >= MEALS_PER_DAY:
+                return "already_served"
+            served[uid] = served.get(uid, 0) + 1
+        try:
+            self.save() # An offline meal must still count after a scanner restart
+        except OSError as e:
+            print(f"Kunne ikke gemme offline-listen: {e}")
+        return "authorized"
+
+
+auth_snapshot = None # AuthSnapshot, loaded in main()
+
+
+def run_snapshot_sync(snapshot):
+    while True:
+        try:
+            applied = snapshot.sync()
+            if applied:
+                print(f"🔄 Offline-liste opdateret: {applied} ændringer (version {snapshot.version}).")
+        except (requests.RequestException, ValueError, KeyError):
+            pass # Server unreachable; keep using the snapshot we have
+        time.sleep(SNAPSHOT_SYNC_INTERVAL)
+
+
+def now_ms():
+    return time.time() * 1000
+
+
+def new_trace():
+    """Starts the trace of a tap at card detection: a correlation ID (tap_id) plus phase timestamps in ms.
+
+    The server keeps the trace and adds its own phases (see /api/debug/taps in app.py).
+    """
+    return {"tap_id": uuid.uuid4().hex[:16], "detected": now_ms()}
+
+
+def send_scan(uid, lane=None, trace=None):
+    """Sends a tap to the server. Returns the decision made here if the server was unreachable, else None."""
+    trace = trace or new_trace()
+    decision = None
+    print(f"📲 Detekteret tag: {uid} (lane {lane}, tap {trace['tap_id']})")
+    scanned_at = datetime.now().isoformat(timespec="milliseconds")
+    try:
+        # This is the core action: sending the UID to your Flask app
+        trace["sent"] = now_ms()
+        phases = {k: v for k, v in trace.items() if k != "tap_id"}
+        response = session.post(SERVER_URL + SCAN_PATH,
+                                json={"uid": uid, "lane": lane, "tap_id": trace["tap_id"], "trace": phases},
+                                timeout=REQUEST_TIMEOUT)
+        print(f"⏱️  Svar efter {now_ms() - trace['detected']:.0f} ms fra kortet blev registreret")
+
+        try:
+            data = response.json()
+        except Exception:
+            print("❌ Server svarede ikke med gyldig JSON.")
+            data = {}
+
+        if response.status_code == 200:
+            print("✅ Kendt UID:", data.get("name"))
+            if auth_snapshot is not None:
+                auth_snapshot.record_served(uid)
+        elif response.status_code == 403 and data.get("status") == "expired":
+            print(f"⚠️  Abonnement udløbet for: {data.get('name')}")
+        elif response.status_code == 403 and data.get("status") == "already_served":
+            print(f"🍽️  Har allerede fået mad i dag: {data.get('name')}")
+            if auth_snapshot is not None:
+                auth_snapshot.record_served(uid, MEALS_PER_DAY)
+        elif response.status_code == 404 and data.get("status") == "new":
+            print("🆕 Ukendt kort! Handling handled by server response.")
+        else:
+            print("❓ Uventet svar:", data)
+
+    except requests.ConnectionError as e:
+        # The tap never reached the server (includes connect timeouts), so it is buffered
+        print("❌ Fejl ved kontakt til server:", e)
+        if auth_snapshot is not None:
+            # Decide locally so the line keeps moving; the server reconciles when the tap is replayed
+            decision = auth_snapshot.decide(uid)
+            print(f"📴 Offline-afgørelse: {decision}")
+        if tap_queue is not None:
+            tap_queue.put(uid, lane, scanned_at, decision, trace["tap_id"])
+            print(f"💾 Scanning gemt til senere ({tap_queue.count()} i kø).")
+    except requests.RequestException as e:
+        # E.g. a read timeout: the server got the tap and is most likely still handling it, so it isn't buffered
+        print("❌ Intet svar fra serveren, scanningen gemmes ikke:", e)
+    return decision
+
+
+# --- Lanes ---
+# Every attached reader is its own serving lane. Each lane gets a worker
+# thread, so a slow server reply on one lane never holds up a tap on another.
+
+def send_remove(lane=None):
+    """Tells the server the card left the lane's reader (welcome screens go back to the start page)."""
+    try:
+        session.post(SERVER_URL + REMOVE_PATH, json={"lane": lane}, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException as e:
+        # Not buffered: once the server is back, the next tap sets the lane's state anyway
+        print("❌ Kunne ikke melde kort fjernet:", e)
+
+
+class LaneMap:
+    """Assigns a lane ID to each reader name: fixed ones from --lane, else 1, 2, 3... in order of appearance."""
+
+    def __init__(self, fixed=None):
+        self.fixed = dict(fixed or {})
+        self.lanes = {}
+        self.lock = threading.Lock()
+
+    def lane_for(self, reader):
+        name = str(reader)
+        with self.lock:
+            if name not in self.lanes:
+                if name in self.fixed:
+                    self.lanes[name] = self.fixed[name]
+                else:
+                    taken = set(self.lanes.values()) | set(self.fixed.values())
+                    n = 1
+                    while str(n) in taken:
+                        n += 1
+                    self.lanes[name] = str(n)
+                print(f"🛤️  Læser '{name}' kører som lane {self.lanes[name]}")
+            return self.lanes[name]
+
+
+class LaneWorker:
+    """Reads and sends the taps of one lane, in order, on its own thread."""
+
+    def __init__(self, lane):
+        self.lane = lane
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name=f"lane-{lane}", daemon=True)
+        self.thread.start()
+
+    def submit(self, card, uid=None, trace=None):
+        """Queues a tap. If the UID isn't known yet it is read from the card on the worker thread."""
+        self.jobs.put((card, uid, trace or new_trace()))
+
+    def submit_removal(self):
+        """Queues a card-removed notice (after the lane's pending taps, so the server sees them in order)."""
+        self.jobs.put((None, None, None))
+
+    def run(self):
+        while True:
+            card, uid, trace = self.jobs.get()
+            if trace is None:
+                send_remove(self.lane)
+                continue
+            if uid is None:
+                uid = get_uid(card)
+                trace["uid_read"] = now_ms()
+            if uid:
+                decision = send_scan(uid, self.lane, trace)
+                if decision is not None:
+                    # The kiosk screen comes from the server, which is down: the reader shows the verdict instead
+                    signal_verdict(card, decision == "authorized")
+
+
+class LaneDispatcher:
+    def __init__(self, lane_map):
+        self.lane_map = lane_map
+        self.workers = {}
+        self.lock = threading.Lock()
+
+    def worker_for(self, reader):
+        lane = self.lane_map.lane_for(reader)
+        with self.lock:
+            if lane not in self.workers:
+                self.workers[lane] = LaneWorker(lane)
+            return self.workers[lane]
+
+
+class ScanObserver:
+    """Card monitor observer: hands each inserted card to its lane's worker.
+
+    pyscard's CardMonitor calls update(observable, (added_cards, removed_cards))
+    from its own thread whenever any reader reports a change, so there is no
+    polling loop and no reconnect while the readers are idle.
+    """
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+
+    def update(self, observable, actions):
+        added_cards, removed_cards = actions
+        for card in added_cards:
+            self.dispatcher.worker_for(card.reader).submit(card)
+        for card in removed_cards:
+            print(f"💤 Kort fjernet (lane {self.dispatcher.lane_map.lane_for(card.reader)})")
+            self.dispatcher.worker_for(card.reader).submit_removal()
+
+
+def run_event_mode(CardMonitor, dispatcher):
+    print("📡 NFC Scanner started (event mode).")
+    monitor = CardMonitor()
+    observer = ScanObserver(dispatcher)
+    monitor.addObserver(observer)
+    try:
+        # All work happens on the card monitor thread; this one just stays alive
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        monitor.deleteObserver(observer)
+
+
+def run_poll_mode(readers, dispatcher):
+    # The old 1-second polling loop, kept for readers whose driver doesn't report card events
+    print("📡 NFC Scanner started (poll mode).")
+    last_uids = {} # reader name -> UID currently on that reader
 
     while True:
         reader_list = readers()
@@ -37,49 +482,69 @@ def main():
             time.sleep(1)
             continue
 
-        reader = reader_list[0]
-        uid = get_uid(reader)
-
-        if uid and uid != last_uid:
-            print(f"📲 Detekteret tag: {uid}")
-            try:
-                # This is the core action: sending the UID to your Flask app
-                response = requests.post("http://127.0.0.1:5000/api/scan", json={"uid": uid})
-
-                try:
-                    data = response.json()
-                except Exception:
-                    print("❌ Server svarede ikke med gyldig JSON.")
-                    data = {}
-
-                if response.status_code == 200:
-                    print("✅ Kendt UID:", data.get("name"))
-                    # Removed the webbrowser.open() call here
-                    # redirect_url = data.get("redirect_url")
-                    # if redirect_url:
-                    #     webbrowser.open(f"http://127.0.0.1:5000{redirect_url}")
-
-                elif response.status_code == 403 and data.get("status") == "expired":
-                    print(f"⚠️  Abonnement udløbet for: {data.get('name')}")
-                elif response.status_code == 404 and data.get("status") == "new":
-                    print("🆕 Ukendt kort! Handling handled by server response.")
-                    # Removed the webbrowser.open() call here
-                    # if "redirect_url" in data:
-                    #     webbrowser.open(f"http://127.0.0.1:5000{data['redirect_url']}")
-                else:
-                    print("❓ Uventet svar:", data)
-
-            except requests.RequestException as e:
-                print("❌ Fejl ved kontakt til server:", e)
+        for reader in reader_list:
+            name = str(reader)
+            last_uid = last_uids.get(name)
+            trace = new_trace()
+            uid = get_uid(reader)
 
-            last_uid = uid
+            if uid and uid != last_uid:
+                trace["uid_read"] = now_ms()
+                dispatcher.worker_for(reader).submit(reader, uid, trace)
+                last_uids[name] = uid
 
-        elif not uid and last_uid:
-            print("💤 Kort fjernet")
-            last_uid = None
+            elif not uid and last_uid:
+                print("💤 Kort fjernet")
+                last_uids.pop(name, None)
+                dispatcher.worker_for(reader).submit_removal()
 
         time.sleep(1)
 
 
+def parse_lane_args(values):
+    """Parses --lane "READER NAME=LANE" options into {reader name: lane}."""
+    fixed = {}
+    for value in values or []:
+        reader, sep, lane = value.rpartition("=")
+        if not sep or not reader or not lane:
+            raise SystemExit(f"Ugyldig --lane værdi: {value!r} (forventet \"LÆSER=LANE\")")
+        fixed[reader] = lane
+    return fixed
+
+
+def run_heartbeat():
+    while True:
+        print(HEARTBEAT_LINE, flush=True)
+        time.sleep(HEARTBEAT_INTERVAL)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="NFC scanner for the canteen terminal")
+    parser.add_argument("--poll", action="store_true", help="use the old 1-second polling loop instead of card events")
+    parser.add_argument("--fake", action="store_true", help="use the fake reader backend (no hardware needed)")
+    parser.add_argument("--lane", action="append", metavar="READER=LANE",
+                        help="fix the lane ID of a reader (repeatable); other readers are numbered 1, 2, 3...")
+    args = parser.parse_args(argv)
+
+    global tap_queue, auth_snapshot
+    threading.Thread(target=run_heartbeat, name="heartbeat", daemon=True).start()
+    tap_queue = TapQueue()
+    threading.Thread(target=run_replayer, args=(tap_queue,), name="replayer", daemon=True).start()
+    auth_snapshot = AuthSnapshot()
+    threading.Thread(target=run_snapshot_sync, args=(auth_snapshot,), name="snapshot-sync", daemon=True).start()
+
+    readers, CardMonitor = load_backend(fake=args.fake)
+    lane_map = LaneMap(parse_lane_args(args.lane))
+    # Number the readers present at startup in a stable order
+    for reader in readers():
+        lane_map.lane_for(reader)
+    dispatcher = LaneDispatcher(lane_map)
+
+    if args.poll:
+        run_poll_mode(readers, dispatcher)
+    else:
+        run_event_mode(CardMonitor, dispatcher)
+
+
 if __name__ == "__main__":
     main()
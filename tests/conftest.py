@@ -0,0 +1,63 @@
+"""Shared setup for the tests.
+
+app.py opens its database, bus and log files when it is imported, so every
+test run gets a fresh temporary directory with its own KANTINE_DB before
+anything imports it. Tests share that one database; each test uses its own
+card UIDs (new_uid) so they don't see each other's users or meals.
+"""
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="kantine-tests-")
+
+sys.path.insert(0, ROOT)
+os.environ["KANTINE_DB"] = os.path.join(WORKDIR, "kantine.db")
+os.environ["KANTINE_BUS_DB"] = os.path.join(WORKDIR, "kantine_bus.db")
+for name in ("KANTINE_WORKERS", "KANTINE_WORKER_ID", "KANTINE_MEALS_PER_DAY", "KANTINE_LISTEN_FD"):
+    os.environ.pop(name, None) # One worker, one meal per day
+os.chdir(WORKDIR) # scanner.log and other relative paths end up here
+
+
+def new_uid():
+    """A card UID no other test uses, in the reader's format ("04 A1 ...")."""
+    return " ".join(f"{b:02X}" for b in bytes.fromhex("04" + uuid.uuid4().hex[:12]))
+
+
+def wait_for(condition, timeout=5):
+    """Polls until condition() is true (e.g. the scan log writer flushed). Fails the test on timeout."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return
+        time.sleep(0.02)
+    pytest.fail("Timed out waiting for condition")
+
+
+@pytest.fixture(scope="session")
+def kantine():
+    import app
+    return app
+
+
+@pytest.fixture
+def client(kantine):
+    return kantine.app.test_client()
+
+
+@pytest.fixture
+def add_user(kantine):
+    """Adds a user and returns its UID. valid_until defaults to a subscription running 30 more days."""
+    def add(name="Test Elev", valid_until=None, uid=None):
+        uid = uid or new_uid()
+        if valid_until is None:
+            valid_until = (date.today() + timedelta(days=30)).isoformat()
+        assert kantine.add_user(uid, name, valid_until)
+        return uid
+    return add
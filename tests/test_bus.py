@@ -0,0 +1,49 @@
+"""The cross-worker event bus (bus.py) and merged /metrics."""
+import bus
+import metrics
+from conftest import wait_for
+
+
+def test_events_reach_other_workers_only(tmp_path):
+    path = str(tmp_path / "bus.db")
+    received = []
+    listener = bus.EventBus(path, enabled=True)
+    listener.origin = 1 # Both buses live in this process; give them different worker origins
+    listener.subscribe("user_changed", lambda event_id, data: received.append((event_id, data)))
+    listener.start()
+    publisher = bus.EventBus(path, enabled=True)
+    publisher.origin = 2
+    publisher.start(listen=False)
+    assert publisher.thread is None
+
+    own_id = listener.publish("user_changed", {"uids": ["04 00"]})
+    event_id = publisher.publish("user_changed", {"uids": ["04 A1"]})
+
+    wait_for(lambda: received)
+    assert own_id < event_id
+    assert received == [(event_id, {"uids": ["04 A1"]})]
+    assert listener.delivered == 1
+
+
+def test_disabled_bus_does_nothing(tmp_path):
+    single = bus.EventBus(str(tmp_path / "bus.db"))
+    single.start()
+    assert single.publish("user_changed", {"uids": []}) is None
+    assert not (tmp_path / "bus.db").exists()
+
+
+def test_metrics_of_all_workers_in_one_scrape(kantine):
+    kantine.SCAN_SECONDS.labels("authorized").observe(0.01)
+    own = metrics.collect({"worker": 0})
+    other = metrics.collect({"worker": 1})
+    text = metrics.render([own, other])
+
+    assert text.count("# TYPE kantine_scan_seconds histogram") == 1
+    assert 'kantine_scan_seconds_count{outcome="authorized",worker="0"}' in text
+    assert 'kantine_scan_seconds_count{outcome="authorized",worker="1"}' in text
+
+
+def test_metrics_endpoint(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "# TYPE kantine_scan_seconds histogram" in response.get_data(as_text=True)
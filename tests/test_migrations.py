@@ -0,0 +1,86 @@
+"""Schema migrations and the roster CLI (roster.py)."""
+import sqlite3
+from datetime import date, timedelta
+
+import roster
+from conftest import new_uid
+
+# A database from the first release: users and foods only
+OLD_SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, nfc_id TEXT UNIQUE, name TEXT, subscription_valid_until TEXT)",
+    "CREATE TABLE foods (id INTEGER PRIMARY KEY, name TEXT, image_url TEXT)",
+]
+
+
+def test_database_is_at_latest_version(kantine):
+    assert kantine.db.query_one("PRAGMA user_version")[0] == len(kantine.MIGRATIONS)
+
+
+def test_old_database_is_migrated(kantine, tmp_path):
+    conn = sqlite3.connect(tmp_path / "old.db", isolation_level=None)
+    for statement in OLD_SCHEMA:
+        conn.execute(statement)
+    conn.executemany("INSERT INTO users (nfc_id, name, subscription_valid_until) VALUES (?, ?, ?)",
+                     [("04 01", "Padded", "2030-02-01"), ("04 02", "Unpadded", "2030-1-5"), ("04 03", "Garbage", "snart")])
+    conn.execute("INSERT INTO foods (name, image_url) VALUES ('Frikadeller', '')")
+
+    kantine.init_schema(conn)
+    kantine.init_schema(conn) # Starting again changes nothing
+
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(kantine.MIGRATIONS)
+    users = conn.execute("SELECT nfc_id, subscription_valid_until, valid_until_day FROM users ORDER BY id").fetchall()
+    assert users == [("04 01", "2030-02-01", date(2030, 2, 1).toordinal()),
+                     ("04 02", "2030-01-05", date(2030, 1, 5).toordinal()),
+                     ("04 03", "snart", None)]
+    assert "tap_id" in [row[1] for row in conn.execute("PRAGMA table_info(scans)")]
+    assert conn.execute("SELECT name, allergens FROM foods").fetchall() == [("Frikadeller", None)]
+    # Existing users are in the change feed for the scanner's offline snapshot, the padded one again with its new date
+    assert [row[0] for row in conn.execute("SELECT change_seq FROM users ORDER BY id")] == [1, 4, 3]
+    conn.close()
+
+
+def test_renew_until_is_stored_zero_padded(kantine, add_user):
+    uid = add_user()
+    assert kantine.renew_subscriptions([uid], until=date(2031, 3, 4)) == 1
+    row = kantine.db.query_one("SELECT subscription_valid_until, valid_until_day FROM users WHERE nfc_id = ?", (uid,))
+    assert row == ("2031-03-04", date(2031, 3, 4).toordinal())
+
+
+def test_roster_import_and_export(kantine, tmp_path):
+    existing, added, bad = new_uid(), new_uid(), new_uid()
+    kantine.add_user(existing, "Gammelt Navn", "2030-01-01")
+    path = tmp_path / "roster.csv"
+    path.write_text("nfc_id,name,subscription_valid_until\n"
+                    f"{existing},Nyt Navn,\n"
+                    f"{added},Ny Elev,2030-3-7\n"
+                    f"{bad},Forkert Dato,7/3/2030\n"
+                    ",Intet Kort,\n"
+                    f"{added},Ny Elev Igen,2030-04-01\n", encoding="utf-8")
+
+    summary = roster.import_roster(path, term_days=30)
+
+    assert summary == {"inserted": 1, "updated": 2, "rejected": 2, "duplicates": 1}
+    rows = dict(kantine.db.query_all("SELECT nfc_id, subscription_valid_until FROM users WHERE nfc_id IN (?, ?, ?)",
+                                     (existing, added, bad)))
+    assert rows == {existing: "2030-01-01", added: "2030-04-01"} # The later line for `added` wins
+
+    out = tmp_path / "export.csv"
+    assert roster.export_roster(out) == kantine.db.query_one("SELECT COUNT(*) FROM users")[0]
+    lines = out.read_text(encoding="utf-8").splitlines()
+    assert lines[0] == "nfc_id,name,subscription_valid_until"
+    assert f"{added},Ny Elev Igen,2030-04-01" in lines
+
+
+def test_roster_import_gives_new_users_a_term(kantine, tmp_path):
+    uid = new_uid()
+    path = tmp_path / "roster.csv"
+    path.write_text(f"nfc_id,name\n{uid},Uden Dato\n", encoding="utf-8")
+    roster.import_roster(path, term_days=30)
+    row = kantine.db.query_one("SELECT subscription_valid_until FROM users WHERE nfc_id = ?", (uid,))
+    assert row == ((date.today() + timedelta(days=30)).isoformat(),)
+
+
+def test_roster_import_without_name_column_changes_nothing(tmp_path):
+    path = tmp_path / "roster.csv"
+    path.write_text("nfc_id\n04 FF\n", encoding="utf-8")
+    assert roster.main(["import", str(path)], 30, "http://127.0.0.1:9/api/cache/reload") == 1
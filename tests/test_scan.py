@@ -0,0 +1,162 @@
+"""/api/scan and /api/scan/bulk: decisions, tap dedup, meal quota and replayed taps."""
+from datetime import date, datetime, timedelta
+
+from conftest import new_uid, wait_for
+
+
+def scan(client, uid, lane="1", tap_id=None):
+    response = client.post("/api/scan", json={"uid": uid, "lane": lane, "tap_id": tap_id})
+    return response.status_code, response.get_json()
+
+
+def bulk(client, scans):
+    response = client.post("/api/scan/bulk", json={"scans": scans})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def meals(kantine, uid, day):
+    row = kantine.db.query_one("SELECT meals FROM meal_usage WHERE nfc_id = ? AND usage_date = ?",
+                               (uid, day.isoformat()))
+    return row[0] if row else 0
+
+
+def logged(kantine, tap_id):
+    return kantine.db.query_one("SELECT outcome FROM scans WHERE tap_id = ?", (tap_id,))
+
+
+def test_unknown_card_is_new(client):
+    status_code, reply = scan(client, new_uid())
+    assert status_code == 404
+    assert reply["status"] == "new"
+
+
+def test_expired_subscription(client, add_user):
+    uid = add_user(valid_until=(date.today() - timedelta(days=1)).isoformat())
+    status_code, reply = scan(client, uid)
+    assert status_code == 403
+    assert reply["status"] == "expired"
+
+
+def test_registration_replaces_new_card_decision(client):
+    uid = new_uid()
+    assert scan(client, uid)[1]["status"] == "new"
+    response = client.post("/api/register", json={"uid": uid, "name": "Ny Elev"})
+    assert response.status_code == 200
+    # Within the dedup window, but the 'new' decision was dropped by the registration
+    status_code, reply = scan(client, uid)
+    assert status_code == 200
+    assert reply["status"] == "authorized"
+    assert reply["name"] == "Ny Elev"
+
+
+def test_repeat_within_window_reuses_decision(kantine, client, add_user):
+    uid = add_user()
+    first = scan(client, uid, tap_id="dedup-1")
+    second = scan(client, uid, tap_id="dedup-2")
+    assert first[0] == second[0] == 200
+    assert second[1]["status"] == "authorized"
+    assert second[1]["tap_id"] == "dedup-2"
+    wait_for(lambda: logged(kantine, "dedup-2") is not None)
+    assert logged(kantine, "dedup-2")[0] == "duplicate"
+    assert meals(kantine, uid, date.today()) == 1 # The repeat was not another meal
+
+
+def test_repeat_marks_card_present_again(kantine, client, add_user):
+    uid = add_user()
+    lane = "dedup-presence"
+    scan(client, uid, lane)
+    wait_for(lambda: kantine.lane_presence.get(lane)["uid"] == uid)
+    client.post("/api/remove", json={"lane": lane})
+    wait_for(lambda: not kantine.lane_presence.get(lane)["present"])
+    scan(client, uid, lane) # Answered from the dedup table
+    wait_for(lambda: kantine.lane_presence.get(lane)["present"])
+    assert kantine.lane_presence.get(lane)["uid"] == uid
+
+
+def test_decision_from_another_worker_is_reused(kantine, client, add_user):
+    uid = add_user()
+    reply = {"message": "Already served today: Anden Worker", "status": "already_served", "name": "Anden Worker"}
+    kantine.on_remote_tap_decided(1, {"uid": uid, "reply": reply, "status_code": 403})
+    status_code, data = scan(client, uid)
+    assert status_code == 403
+    assert data["status"] == "already_served"
+    assert meals(kantine, uid, date.today()) == 0
+
+
+def test_second_meal_is_refused(kantine, client, add_user):
+    uid = add_user()
+    assert scan(client, uid)[0] == 200
+    kantine.tap_dedup.forget(uid) # As if the dedup window had passed
+    status_code, reply = scan(client, uid)
+    assert status_code == 403
+    assert reply["status"] == "already_served"
+    wait_for(lambda: meals(kantine, uid, date.today()) == 1)
+
+
+def test_meal_count_survives_reload(kantine, client, add_user):
+    uid = add_user()
+    assert scan(client, uid)[0] == 200
+    wait_for(lambda: meals(kantine, uid, date.today()) == 1)
+    kantine.meal_quota.load() # What a restart does
+    assert not kantine.meal_quota.claim(uid)
+
+
+def test_bulk_skips_handled_taps(kantine, client, add_user):
+    uid = add_user()
+    live_tap = new_uid()
+    scan(client, uid, tap_id=live_tap)
+    now = datetime.now().isoformat(timespec="milliseconds")
+    replayed = [{"uid": uid, "lane": "1", "scanned_at": now, "tap_id": live_tap},
+                {"uid": uid, "lane": "1", "scanned_at": now, "tap_id": "bulk-twice"},
+                {"uid": uid, "lane": "1", "scanned_at": now, "tap_id": "bulk-twice"}]
+    results = bulk(client, replayed)["results"]
+    assert [r["status"] for r in results] == ["duplicate", "already_served", "duplicate"]
+
+    # The same batch again (e.g. its reply was lost), once the first one is in the scan log
+    wait_for(lambda: logged(kantine, "bulk-twice") is not None)
+    results = bulk(client, replayed)["results"]
+    assert [r["status"] for r in results] == ["duplicate"] * 3
+    wait_for(lambda: meals(kantine, uid, date.today()) == 1)
+
+
+def test_bulk_charges_the_day_of_the_tap(kantine, client, add_user):
+    uid = add_user()
+    yesterday = date.today() - timedelta(days=1)
+    assert scan(client, uid)[0] == 200
+    scanned_at = datetime.combine(yesterday, datetime.min.time()).replace(hour=12).isoformat()
+    results = bulk(client, [{"uid": uid, "lane": "2", "scanned_at": scanned_at, "tap_id": new_uid()},
+                            {"uid": uid, "lane": "2", "scanned_at": scanned_at, "tap_id": new_uid()}])["results"]
+    assert [r["status"] for r in results] == ["authorized", "already_served"]
+    assert meals(kantine, uid, yesterday) == 1
+    wait_for(lambda: meals(kantine, uid, date.today()) == 1)
+
+
+def test_bulk_reports_offline_mismatch(client, add_user):
+    uid = add_user(valid_until=(date.today() - timedelta(days=1)).isoformat())
+    data = bulk(client, [{"uid": uid, "scanned_at": datetime.now().isoformat(), "offline_decision": "authorized"}])
+    assert data["mismatches"] == 1
+    assert data["results"][0]["status"] == "expired"
+    assert data["results"][0]["mismatch"] is True
+
+
+def test_bulk_rejects_malformed_entries(client, add_user):
+    uid = add_user()
+    data = bulk(client, [5, {"uid": 7}, {"lane": "1"}, {"uid": uid, "scanned_at": "not a date"}])
+    statuses = [(r["status"], r["http_status"]) for r in data["results"]]
+    assert statuses == [("error", 400), ("error", 400), ("error", 400), ("authorized", 200)]
+
+    response = client.post("/api/scan/bulk", json={"scans": "AA"})
+    assert response.status_code == 400
+
+
+def test_menu_allergens(client):
+    menu_date = "2030-01-07"
+    response = client.put(f"/api/menu/{menu_date}", json={"description": "Mandag",
+                                                           "dishes": [{"name": "Lasagne", "allergens": "Gluten, Mælk"}]})
+    assert response.status_code == 200
+    assert response.get_json()["retter"][0]["allergener"] == ["Gluten", "Mælk"]
+
+    response = client.put(f"/api/menu/{menu_date}", json={"dishes": [{"name": "Suppe", "allergens": 3}]})
+    assert response.status_code == 400
+    assert client.get("/api/menu/2030-1-7x").status_code == 400
@@ -0,0 +1,113 @@
+"""scanner.py on fake readers (fake_reader.py): taps online, offline decisions on the reader, and replay."""
+import sqlite3
+import uuid
+
+import pytest
+import requests
+
+import fake_reader
+import scanner
+from conftest import new_uid, wait_for
+
+
+class ServerSession:
+    """Stands in for scanner.session: hands requests to the Flask test client, or raises `error` like a down server."""
+
+    def __init__(self, client):
+        self.client = client
+        self.error = None
+
+    def request(self, method, url, json=None, params=None, timeout=None):
+        if self.error is not None:
+            raise self.error("Server unreachable (test)")
+        reply = self.client.open(url.removeprefix(scanner.SERVER_URL), method=method, json=json, query_string=params)
+        response = requests.Response()
+        response.status_code = reply.status_code
+        response._content = reply.get_data()
+        response.url = url
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+@pytest.fixture
+def server(client, monkeypatch, tmp_path):
+    session = ServerSession(client)
+    monkeypatch.setattr(scanner, "session", session)
+    monkeypatch.setattr(scanner, "tap_queue", scanner.TapQueue(str(tmp_path / "scanner_queue.db")))
+    monkeypatch.setattr(scanner, "auth_snapshot", scanner.AuthSnapshot(str(tmp_path / "scanner_snapshot.json")))
+    return session
+
+
+@pytest.fixture
+def reader(server):
+    """A fake reader watched by the scanner's card monitor pipeline, as in event mode."""
+    reader = fake_reader.add_reader(f"Test Reader {uuid.uuid4().hex[:6]}")
+    monitor = fake_reader.CardMonitor()
+    observer = scanner.ScanObserver(scanner.LaneDispatcher(scanner.LaneMap({str(reader): "1"})))
+    monitor.addObserver(observer)
+    yield reader
+    monitor.deleteObserver(observer)
+
+
+def tap(reader, uid, handled):
+    """Holds the card on the reader until handled() is true, like a student waiting for the verdict."""
+    fake_reader.insert(uid, reader)
+    wait_for(handled)
+    fake_reader.remove(reader)
+
+
+def test_online_tap_is_decided_by_server(kantine, reader, add_user):
+    uid = add_user()
+    tap(reader, uid, lambda: scanner.auth_snapshot.served.get(uid) == 1)
+    assert reader.signals == [] # The kiosk screen shows the result
+    assert scanner.tap_queue.count() == 0
+
+
+def test_offline_taps_are_decided_on_reader_and_replayed(kantine, server, reader, add_user):
+    uid = add_user()
+    expired = add_user(valid_until="2020-01-01")
+    scanner.auth_snapshot.sync()
+    server.error = requests.ConnectionError
+
+    for n, card in enumerate((uid, uid, expired, new_uid()), start=1):
+        tap(reader, card, lambda: len(reader.signals) == n)
+    assert reader.signals == [scanner.VERDICT_SIGNALS[True]] + [scanner.VERDICT_SIGNALS[False]] * 3
+    decisions = [row[4] for row in scanner.tap_queue.peek(10)]
+    assert decisions == ["authorized", "already_served", "expired", "new"]
+
+    # The offline meal still counts after a scanner restart
+    assert scanner.AuthSnapshot(scanner.auth_snapshot.path).decide(uid) == "already_served"
+
+    server.error = None
+    assert scanner.replay_pending(scanner.tap_queue) == 4
+    assert scanner.tap_queue.count() == 0
+    assert not kantine.meal_quota.claim(uid) # The server counted the offline meal too
+
+
+def test_read_timeout_is_not_buffered(server, add_user):
+    uid = add_user()
+    scanner.auth_snapshot.sync()
+    # The server got the tap and is most likely still handling it: no offline decision, nothing to replay
+    server.error = requests.ReadTimeout
+    assert scanner.send_scan(uid, "1") is None
+    assert scanner.tap_queue.count() == 0
+    assert scanner.auth_snapshot.decide(uid) == "authorized" # No meal was counted offline
+
+
+def test_queue_file_from_older_scanner(tmp_path):
+    path = str(tmp_path / "scanner_queue.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE pending_scans (id INTEGER PRIMARY KEY AUTOINCREMENT, uid TEXT NOT NULL, lane TEXT, scanned_at TEXT NOT NULL)")
+    conn.execute("INSERT INTO pending_scans (uid, lane, scanned_at) VALUES ('04 A1', '1', '2026-10-18T11:30:00')")
+    conn.commit()
+    conn.close()
+
+    tap_queue = scanner.TapQueue(path)
+    tap_queue.put("04 A2", "1", "2026-10-18T11:31:00", "authorized", "tap-2")
+    assert tap_queue.peek(10) == [(1, "04 A1", "1", "2026-10-18T11:30:00", None, None),
+                                  (2, "04 A2", "1", "2026-10-18T11:31:00", "authorized", "tap-2")]